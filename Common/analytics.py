@@ -0,0 +1,66 @@
+"""Reclaimable-space analytics for the Phasarr duplicate cleaners.
+
+Every duplicate group is folded into per-dimension byte totals in a single pass:
+instance, Plex library, resolution and video codec. The largest items are kept
+in a bounded heap, so memory stays flat however many groups are added. Bytes
+are attributed using each discarded file's own size and codecs.
+"""
+import heapq
+import itertools
+import logging
+from collections import Counter
+
+from disposal import format_bytes
+from policy import DuplicatePolicy
+
+log = logging.getLogger(__name__)
+
+DIMENSIONS = ('instance', 'library', 'video_resolution', 'video_codec')
+
+
+class ReclaimableSpace:
+    """Aggregate the bytes that disposing of the duplicates would free"""
+
+    def __init__(self, top=10):
+        self.top = top
+        self.bytes = {dimension: Counter() for dimension in DIMENSIONS}
+        self.files = {dimension: Counter() for dimension in DIMENSIONS}
+        self.offenders = []
+        # Tie breaker so heap entries never compare titles or years
+        self.sequence = itertools.count()
+
+    def add_groups(self, instance, library, files_to_delete, same_file):
+        """Add the discardable files of every (title, plex_files, arr_file, media_info) group"""
+        for title, plex_files, arr_file, media_info in files_to_delete:
+            attributes = DuplicatePolicy.file_attributes(media_info)
+            group_bytes = 0
+            for file in plex_files:
+                if same_file(file, arr_file):
+                    continue
+                details = attributes.get(str(file), {})
+                size = details.get('file_size') or 0
+                group_bytes += size
+                for dimension, value in (('instance', instance), ('library', library),
+                                         ('video_resolution', details.get('video_resolution') or 'Unknown'),
+                                         ('video_codec', details.get('video_codec') or 'Unknown')):
+                    self.bytes[dimension][value] += size
+                    self.files[dimension][value] += 1
+
+            entry = (group_bytes, next(self.sequence), instance, title, media_info.get('year'))
+            if len(self.offenders) < self.top:
+                heapq.heappush(self.offenders, entry)
+            elif group_bytes > self.offenders[0][0]:
+                heapq.heapreplace(self.offenders, entry)
+
+    def log_summary(self):
+        """Log the totals per dimension and the top offenders, largest first"""
+        total = sum(self.bytes['instance'].values())
+        log.info(f"Reclaimable space: {format_bytes(total)} in {sum(self.files['instance'].values())} files")
+        for dimension in DIMENSIONS:
+            log.info(f"By {dimension.replace('_', ' ')}:")
+            for value, size in self.bytes[dimension].most_common():
+                share = size / total * 100 if total else 0
+                log.info(f"  {value}: {format_bytes(size)} ({share:.1f}%, {self.files[dimension][value]} files)")
+        log.info(f"Top {len(self.offenders)} items:")
+        for rank, (size, _, instance, title, year) in enumerate(sorted(self.offenders, reverse=True), 1):
+            log.info(f"  {rank}. {title}{f' ({year})' if year else ''} [{instance}]: {format_bytes(size)}")
@@ -0,0 +1,183 @@
+"""Shared HTTP client for the Starr-Apps-Tools Python scripts.
+
+Every script talks to Plex and the *arr apps through an ArrClient, which keeps a
+pooled keep-alive session per host, retries 429 responses and requests that
+never reached the server, plus 5xx responses and read errors of idempotent
+requests, with jittered exponential backoff, rate limits each instance with a token bucket and counts
+requests, bytes and latency so slow instances are easy to spot.
+"""
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A 5xx or a read timeout may come after the server acted on the request,
+# so only these methods are retried on one by default
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+MAX_BACKOFF = 60
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+
+def not_sent(error):
+    """Whether a connection error happened before the request reached the server"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class TokenBucket:
+    """Token-bucket rate limiter that allows bursts of up to `capacity` requests"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ClientStats:
+    """Thread-safe request, error, retry and byte counters plus a latency histogram"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latency = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+
+    def record(self, seconds, size, error=False):
+        """Record one completed request"""
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.bytes += size
+            self.latency[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.latency_sum += seconds
+
+    def record_retry(self):
+        """Record a request that is about to be retried"""
+        with self.lock:
+            self.retries += 1
+
+    def summary(self):
+        """Return a one-line summary of the counters and latency histogram"""
+        with self.lock:
+            histogram = ", ".join(
+                f"<={bound}s: {count}" if bound != float('inf') else f">{LATENCY_BUCKETS[-2]}s: {count}"
+                for bound, count in zip(LATENCY_BUCKETS, self.latency) if count
+            )
+            return (f"{self.requests} requests, {self.errors} errors, {self.retries} retries, "
+                    f"{self.bytes / 1024 / 1024:.1f} MiB received, latency [{histogram}]")
+
+
+class ArrClient:
+    """Pooled HTTP client with retries, per-host rate limiting and request metrics"""
+
+    def __init__(self, timeout=30, retries=3, backoff=1.0, rate_limit=None, pool_size=10):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limit = rate_limit
+        self.stats = ClientStats()
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+        # requests keeps one connection pool per host on each adapter, so every
+        # instance gets its own pool of keep-alive connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    def _bucket(self, url):
+        """Get the token bucket for the host a URL points at"""
+        host = urlsplit(url).netloc
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate_limit)
+            return self.buckets[host]
+
+    def _backoff(self, attempt, response=None):
+        """Seconds to wait before the next attempt, honouring Retry-After when present"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), MAX_BACKOFF)
+        return random.uniform(0, min(self.backoff * 2 ** attempt, MAX_BACKOFF))
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """Send a request, retrying 429 responses and connections that could not be opened
+
+        5xx responses and errors after the request was sent are only retried for
+        idempotent requests: GET, HEAD and OPTIONS by default, or any method when
+        idempotent is true.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in SAFE_METHODS
+        retry_statuses = RETRY_STATUSES if idempotent else {429}
+        for attempt in range(self.retries + 1):
+            if self.rate_limit:
+                self._bucket(url).acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.stats.record(time.monotonic() - start, 0, error=True)
+                if attempt == self.retries or not (idempotent or not_sent(e)):
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if kwargs.get('stream'):
+                    size = int(response.headers.get('Content-Length', 0))
+                else:
+                    size = len(response.content)
+                self.stats.record(time.monotonic() - start, size, error=response.status_code >= 400)
+                if response.status_code not in retry_statuses or attempt == self.retries:
+                    return response
+                delay = self._backoff(attempt, response)
+                # Hand the connection back to the pool, a streamed body would otherwise hold it
+                response.close()
+            self.stats.record_retry()
+            log.debug(f"Retrying {method} {urlsplit(url).netloc}{urlsplit(url).path} in {delay:.1f}s (attempt {attempt + 1})")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
@@ -0,0 +1,250 @@
+"""File disposal engine for the Phasarr duplicate cleaners.
+
+Duplicates are either deleted or moved to the trash. Each filesystem gets its
+own trash root at <mountpoint>/.phasarr-trash, so moving a file is a
+metadata-only os.rename no matter how big it is. The configured trash directory
+is used for files on its own filesystem, and as the fallback when a mount has
+no writable trash root. Moves that still cross filesystems have to copy the
+data, so they are grouped by (source device, destination device) and copied by
+a bounded pool of workers, interleaving the groups so concurrent copies read
+from different disks. Progress is reported in bytes with throughput and ETA.
+
+Every move is appended to a JSON lines restore index, which restore_files uses
+to put the files back where they came from.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain, zip_longest
+
+from tqdm import tqdm
+
+log = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+MOUNT_TRASH_NAME = '.phasarr-trash'
+
+
+def copy_then_remove(source, destination, progress):
+    """Copy a file across filesystems in chunks, updating progress, then remove the source"""
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                dst.write(chunk)
+                progress.update(len(chunk))
+        shutil.copystat(source, destination)
+    except BaseException:
+        # Never leave a partial copy in the trash
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    try:
+        os.remove(source)
+    except BaseException:
+        # The source stays in place, so drop the copy rather than keep the file in two places
+        os.remove(destination)
+        raise
+
+
+def format_bytes(size):
+    """Human readable size in binary units"""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def find_mount_point(path):
+    """Walk up from a path to the mount point of the filesystem it lives on"""
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+class TrashRoots:
+    """Pick a trash directory on the same filesystem as each file, falling back to the configured one"""
+
+    def __init__(self, trash_dir, per_mount=True):
+        self.trash_dir = str(trash_dir)
+        self.per_mount = per_mount
+        self.roots = {os.stat(self.trash_dir).st_dev: self.trash_dir}
+
+    def for_file(self, path, device):
+        """Trash directory for a file on the given device"""
+        if device not in self.roots:
+            self.roots[device] = self.trash_dir
+            if self.per_mount:
+                root = os.path.join(find_mount_point(path), MOUNT_TRASH_NAME)
+                try:
+                    os.makedirs(root, exist_ok=True)
+                    if os.stat(root).st_dev == device:
+                        self.roots[device] = root
+                        log.info(f"Using trash root {root}")
+                except OSError as e:
+                    log.warning(f"Cannot use trash root {root}, falling back to {self.trash_dir}: {str(e)}")
+        return self.roots[device]
+
+
+def unique_destination(directory, name, taken):
+    """Path for name in directory that overwrites neither an existing file nor a pending copy"""
+    destination = os.path.join(directory, name)
+    stem, ext = os.path.splitext(name)
+    counter = 1
+    while destination in taken or os.path.lexists(destination):
+        destination = os.path.join(directory, f"{stem}.{counter}{ext}")
+        counter += 1
+    taken.add(destination)
+    return destination
+
+
+class RestoreIndex:
+    """Append-only JSON lines log of the moves made into the trash"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a') if path else None
+
+    def record(self, source, destination):
+        if self.file:
+            entry = {'source': source, 'trash': destination, 'moved_at': datetime.now().isoformat(timespec='seconds')}
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def dispose_files(files, trash_dir, permanent_delete=False, workers=4, per_mount_trash=True, restore_index=None):
+    """Delete or move (source, trash name) pairs to the trash, returning (processed, failed)
+
+    processed holds (source, destination or "Deleted") tuples and failed holds
+    the source paths that could not be disposed of.
+    """
+    processed = []
+    failed = []
+    copies = defaultdict(list)
+    devices = {}
+    taken = set()
+    trash_roots = TrashRoots(trash_dir, per_mount_trash)
+    index = RestoreIndex(None if permanent_delete else restore_index)
+
+    try:
+        for source, name in files:
+            try:
+                stat = os.stat(source)
+            except FileNotFoundError:
+                log.warning(f"File not found: {source}")
+                failed.append(source)
+                continue
+            except OSError as e:
+                log.error(f"Failed to stat {source}: {str(e)}")
+                failed.append(source)
+                continue
+
+            try:
+                if permanent_delete:
+                    os.remove(source)
+                    processed.append((source, "Deleted"))
+                    log.info(f"Successfully deleted: {source}")
+                    continue
+
+                directory = trash_roots.for_file(source, stat.st_dev)
+                destination = unique_destination(directory, name, taken)
+                if directory not in devices:
+                    devices[directory] = os.stat(directory).st_dev
+                if stat.st_dev == devices[directory]:
+                    os.rename(source, destination)
+                    index.record(source, destination)
+                    processed.append((source, destination))
+                    log.info(f"Successfully moved: {source} to {destination}")
+                else:
+                    copies[(stat.st_dev, devices[directory])].append((source, destination, stat.st_size))
+            except Exception as e:
+                failed.append(source)
+                log.error(f"Failed to {'delete' if permanent_delete else 'move'} {source}: {str(e)}")
+
+        if copies:
+            copied, copy_failed = copy_across_devices(copies, workers, index)
+            processed.extend(copied)
+            failed.extend(copy_failed)
+    finally:
+        index.close()
+
+    return processed, failed
+
+
+def copy_across_devices(groups, workers, index):
+    """Copy the grouped cross-device moves concurrently, reporting bytes/sec and ETA"""
+    # Round-robin over the device groups so the workers spread across disks
+    ordered = [move for move in chain.from_iterable(zip_longest(*groups.values())) if move]
+    total_bytes = sum(size for _, _, size in ordered)
+    log.info(f"Copying {len(ordered)} files ({format_bytes(total_bytes)}) across "
+             f"{len(groups)} device pairs with {workers} workers...")
+
+    copied = []
+    failed = []
+    start = time.monotonic()
+    with tqdm(total=total_bytes, desc="Copying", unit='B', unit_scale=True, unit_divisor=1024) as progress, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(copy_then_remove, source, destination, progress): (source, destination)
+            for source, destination, _ in ordered
+        }
+        for future in as_completed(futures):
+            source, destination = futures[future]
+            try:
+                future.result()
+                index.record(source, destination)
+                copied.append((source, destination))
+                log.info(f"Successfully moved: {source} to {destination}")
+            except Exception as e:
+                failed.append(source)
+                log.error(f"Failed to move {source}: {str(e)}")
+
+    elapsed = time.monotonic() - start
+    log.info(f"Copied {format_bytes(progress.n)} in {elapsed:.1f}s "
+             f"({format_bytes(progress.n / elapsed if elapsed else 0)}/s)")
+    return copied, failed
+
+
+def restore_files(restore_index):
+    """Move every file in the restore index back to where it came from, returning (restored, failed)"""
+    if not os.path.exists(restore_index):
+        log.info(f"No restore index at {restore_index}")
+        return [], []
+
+    with open(restore_index) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    restored = []
+    failed = []
+    remaining = []
+    for entry in entries:
+        source, trash = entry['source'], entry['trash']
+        try:
+            if not os.path.exists(trash):
+                log.warning(f"No longer in the trash: {trash}")
+                continue
+            if os.path.lexists(source):
+                raise FileExistsError(f"{source} already exists")
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+            shutil.move(trash, source)
+            restored.append((trash, source))
+            log.info(f"Restored: {trash} to {source}")
+        except Exception as e:
+            failed.append(trash)
+            remaining.append(entry)
+            log.error(f"Failed to restore {trash}: {str(e)}")
+
+    # Keep only the entries that could not be restored
+    with open(restore_index, 'w') as f:
+        for entry in remaining:
+            f.write(json.dumps(entry) + '\n')
+    return restored, failed
@@ -0,0 +1,97 @@
+"""Inventory cache for the Phasarr duplicate cleaners.
+
+Plex duplicates and Radarr/Sonarr inventories are stored in SQLite as
+snapshots keyed by source URL and library section, one JSON row per item, so
+later runs only refetch what changed. A snapshot older than the TTL is
+treated as missing and fetched in full again. MediaInfo is the compact record
+the cleaners keep for each Plex item, and what the Plex snapshots hold.
+"""
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+
+log = logging.getLogger(__name__)
+
+
+class InventoryCache:
+    """SQLite snapshots of Plex and *arr inventories, keyed by (source, section)"""
+
+    def __init__(self, path, ttl=86400, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        # Ignore every stored snapshot, as with --refresh-cache
+        self.refresh = refresh
+
+    def open(self):
+        """Open the cache database, creating its tables on first use"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS snapshots (source TEXT, section TEXT, synced_at REAL, full_sync_at REAL, PRIMARY KEY (source, section))")
+        conn.execute("CREATE TABLE IF NOT EXISTS items (source TEXT, section TEXT, item_key TEXT, updated TEXT, data TEXT, PRIMARY KEY (source, section, item_key))")
+        return conn
+
+    def load(self, source, section):
+        """Load a cached snapshot, or None if it is missing, expired or a refresh was requested"""
+        if self.refresh:
+            return None
+        with closing(self.open()) as conn:
+            row = conn.execute("SELECT synced_at, full_sync_at FROM snapshots WHERE source = ? AND section = ?", (source, section)).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                return None
+            items = {
+                key: json.loads(data)
+                for key, data in conn.execute("SELECT item_key, data FROM items WHERE source = ? AND section = ?", (source, section))
+            }
+        return {'synced_at': row[0], 'full_sync_at': row[1], 'items': items}
+
+    def save(self, source, section, items, synced_at, full_sync_at, removed=()):
+        """Write changed items to the cache; a full sync replaces the whole snapshot"""
+        with closing(self.open()) as conn, conn:
+            if synced_at == full_sync_at:
+                conn.execute("DELETE FROM items WHERE source = ? AND section = ?", (source, section))
+            conn.executemany(
+                "DELETE FROM items WHERE source = ? AND section = ? AND item_key = ?",
+                [(source, section, key) for key in removed]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)",
+                [(source, section, key, item.get('updated', ''), json.dumps(dict(item))) for key, item in items.items()]
+            )
+            conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)", (source, section, synced_at, full_sync_at))
+
+
+class MediaInfo:
+    """Compact record holding only the Plex fields used for matching and reporting"""
+    __slots__ = ('id', 'title', 'year', 'guids', 'file', 'video_resolution', 'video_codec',
+                 'audio_codec', 'file_size', 'parts', 'updated', 'matched_by', 'decision', 'verification')
+
+    def __init__(self, **fields):
+        self.id = fields.get('id')
+        self.title = fields.get('title')
+        self.year = fields.get('year')
+        self.guids = fields.get('guids') or []
+        self.file = fields.get('file') or []
+        self.video_resolution = fields.get('video_resolution', 'Unknown')
+        self.video_codec = fields.get('video_codec', 'Unknown')
+        self.audio_codec = fields.get('audio_codec', 'Unknown')
+        self.file_size = fields.get('file_size', 0)
+        # [file, size, resolution, video codec, audio codec] for each part
+        self.parts = fields.get('parts') or []
+        self.updated = fields.get('updated', '')
+        self.matched_by = fields.get('matched_by')
+        self.decision = fields.get('decision')
+        self.verification = fields.get('verification')
+
+    # Dict-style access keeps media_info['title'] working and lets dict(info) serialize the record
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def keys(self):
+        return self.__slots__
@@ -0,0 +1,80 @@
+"""Matching of Plex duplicates to Radarr/Sonarr files for the Phasarr cleaners.
+
+Plex and Radarr/Sonarr paths are compared as normalized strings, after the
+configured `plex_prefix => arr_prefix` mappings are applied to the Plex side,
+and each path is normalized only once. A Plex item is matched to its managed
+file by GUID first, then by path, then by normalized title and year.
+"""
+import functools
+import logging
+import os
+import re
+
+log = logging.getLogger(__name__)
+
+
+def title_key(title, year=None):
+    """Normalize a title, and optionally a year, for fallback matching"""
+    key = re.sub(r'[^a-z0-9]+', ' ', title.lower()).strip()
+    return f"{key} ({year})" if year else key
+
+
+class FileMatcher:
+    """Compare Plex paths with Radarr/Sonarr paths and match Plex items to managed files"""
+
+    def __init__(self, path_mappings=(), verify_paths=False):
+        self.path_mappings = list(path_mappings)
+        self.verify_paths = verify_paths
+        self.normalize_path = functools.lru_cache(maxsize=None)(self._normalize_path)
+
+    @classmethod
+    def from_config(cls, config, verify_paths=False, section='General'):
+        """Build a matcher from PathMappings, one "plex_prefix => arr_prefix" per line, and VerifyPaths"""
+        path_mappings = [
+            tuple(prefix.strip().rstrip('/') for prefix in line.split('=>', 1))
+            for line in config.get(section, 'PathMappings', fallback='').splitlines() if '=>' in line
+        ]
+        return cls(path_mappings, verify_paths or config.getboolean(section, 'VerifyPaths', fallback=False))
+
+    def _normalize_path(self, path, plex=False):
+        """Normalize a file path so Plex and Radarr/Sonarr paths can be compared as strings"""
+        path = str(path)
+        if plex:
+            for plex_prefix, arr_prefix in self.path_mappings:
+                if path == plex_prefix or path.startswith(plex_prefix + '/'):
+                    path = arr_prefix + path[len(plex_prefix):]
+                    break
+        if self.verify_paths:
+            path = os.path.realpath(path)
+        return os.path.normcase(os.path.normpath(path))
+
+    def same_file(self, plex_file, arr_file):
+        """Check whether a Plex path points at the Radarr/Sonarr file"""
+        return self.normalize_path(plex_file, plex=True) == self.normalize_path(arr_file)
+
+    def build_index(self, arr_items):
+        """Index Radarr/Sonarr file records by GUID, normalized path and normalized title+year"""
+        index = {'guid': {}, 'path': {}, 'title': {}}
+        for record in arr_items:
+            for guid in record['guids']:
+                index['guid'].setdefault(guid, record)
+            index['path'].setdefault(self.normalize_path(record['path']), record)
+            # Same-title releases are ambiguous, so a collision disables the title fallback for that key
+            key = title_key(record['title'], record['year'])
+            index['title'][key] = None if key in index['title'] else record
+        return index
+
+    def match(self, media_info, index):
+        """Find the Radarr/Sonarr record for a Plex item, returning it with the key that matched"""
+        for guid in media_info.get('guids', []):
+            if guid in index['guid']:
+                return index['guid'][guid], guid
+        for file in media_info['file']:
+            record = index['path'].get(self.normalize_path(file, plex=True))
+            if record:
+                return record, 'path'
+        for key in (title_key(media_info['title'], media_info.get('year')), title_key(media_info['title'])):
+            record = index['title'].get(key)
+            if record:
+                return record, 'title'
+        return None, None
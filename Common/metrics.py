@@ -0,0 +1,195 @@
+"""In-process metrics for the long-running Starr-Apps-Tools scripts.
+
+A Metrics registry holds counters, gauges and span timing histograms, each
+labelled (usually by instance). Counters can also keep a sliding window of
+recent increments, reported as a per-hour rate, so throughput drops show up
+without a Prometheus query. serve_metrics exposes everything, together with
+the shared HTTP client's counters, in the Prometheus text format on a local
+/metrics endpoint served from a daemon thread.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from arr_client import LATENCY_BUCKETS
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the span histogram buckets; sleeps can last an hour
+SPAN_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, float('inf'))
+RATE_WINDOW = 3600
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """Render a label tuple as {key="value",...}"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else str(bound)
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters, gauges and span histograms"""
+
+    def __init__(self, namespace, rates=()):
+        self.namespace = namespace
+        self.rates = set(rates)
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.gauges = {}
+        self.spans = {}
+        self.recent = {}
+
+    def describe(self, name, text):
+        """Set the HELP text of a metric"""
+        self.help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        """Increase a counter; counters listed in `rates` also get a per-hour rate"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            if name in self.rates:
+                now = time.monotonic()
+                self.recent.setdefault(key, deque()).append((now, amount))
+                # Prune here too, so the window stays bounded when nobody scrapes /metrics
+                self._prune(key, now)
+
+    def set(self, name, value, **labels):
+        """Set a gauge"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, span, seconds, **labels):
+        """Record the duration of one span"""
+        key = (span, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.spans:
+                self.spans[key] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(SPAN_BUCKETS)}
+            histogram = self.spans[key]
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['buckets'][bisect_left(SPAN_BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def span(self, span, **labels):
+        """Time the body of a with block, whether or not it raises"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(span, time.monotonic() - start, **labels)
+
+    def per_hour(self, name, **labels):
+        """Increments of a rate counter over the last hour"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            return self._window_sum(key, time.monotonic())
+
+    def _prune(self, key, now):
+        """Drop the increments of a rate counter that fell out of the window"""
+        events = self.recent.get(key)
+        while events and now - events[0][0] > RATE_WINDOW:
+            events.popleft()
+
+    def _window_sum(self, key, now):
+        self._prune(key, now)
+        return sum(amount for _, amount in self.recent.get(key) or ())
+
+    def render(self, client=None):
+        """Everything in the Prometheus text exposition format"""
+        prefix = self.namespace + '_'
+        lines = []
+
+        def header(name, kind):
+            if name in self.help:
+                lines.append(f"# HELP {prefix}{name} {self.help[name]}")
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        with self.lock:
+            now = time.monotonic()
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in values}):
+                    metric = f"{name}_total" if kind == 'counter' else name
+                    header(metric, kind)
+                    for (key_name, labels), value in sorted(values.items()):
+                        if key_name == name:
+                            lines.append(f"{prefix}{metric}{format_labels(labels)} {value}")
+
+            for name in sorted(self.rates):
+                header(f"{name}_per_hour", 'gauge')
+                for key in sorted(key for key in self.recent if key[0] == name):
+                    lines.append(f"{prefix}{name}_per_hour{format_labels(key[1])} {self._window_sum(key, now)}")
+
+            if self.spans:
+                header('span_seconds', 'histogram')
+            for (span, labels), histogram in sorted(self.spans.items()):
+                labels = (('span', span),) + labels
+                cumulative = 0
+                for bound, count in zip(SPAN_BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f"{prefix}span_seconds_bucket{format_labels(labels + (('le', format_bound(bound)),))} {cumulative}")
+                lines.append(f"{prefix}span_seconds_sum{format_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{prefix}span_seconds_count{format_labels(labels)} {histogram['count']}")
+
+        if client is not None:
+            lines.extend(render_client_stats(prefix, client.stats))
+        return '\n'.join(lines) + '\n'
+
+
+def render_client_stats(prefix, stats):
+    """The shared HTTP client's counters and latency histogram as Prometheus lines"""
+    lines = []
+    with stats.lock:
+        for name, value, text in (
+            ('http_requests_total', stats.requests, 'Requests sent by the HTTP client, retries included'),
+            ('http_errors_total', stats.errors, 'Requests that failed or returned a 4xx/5xx status'),
+            ('http_retries_total', stats.retries, 'Requests that were retried'),
+            ('http_received_bytes_total', stats.bytes, 'Response bytes received'),
+        ):
+            lines += [f"# HELP {prefix}{name} {text}", f"# TYPE {prefix}{name} counter", f"{prefix}{name} {value}"]
+        lines.append(f"# TYPE {prefix}http_request_seconds histogram")
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats.latency):
+            cumulative += count
+            lines.append(f'{prefix}http_request_seconds_bucket{{le="{format_bound(bound)}"}} {cumulative}')
+        lines.append(f"{prefix}http_request_seconds_sum {stats.latency_sum:.6f}")
+        lines.append(f"{prefix}http_request_seconds_count {stats.requests}")
+    return lines
+
+
+def serve_metrics(metrics, port, host='127.0.0.1', client=None):
+    """Serve GET /metrics from a daemon thread and return the server"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render(client).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    log.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,115 @@
+"""Keep/discard policy for Phasarr duplicate groups.
+
+Unattended runs cannot answer the interactive prompts, so the policy decides
+instead. The file managed by Radarr/Sonarr is always kept. Every other Plex copy
+is discarded unless it ranks higher than the managed file, comparing the fields
+in `rank_by` in order (by default resolution, then video codec). Better copies
+are kept for a human to look at. Groups where the managed file is not one of
+the Plex copies are skipped, since there is nothing to compare against.
+
+Every lookup is a dict access on precomputed rank tables, so thousands of
+groups are evaluated in one pass in well under a second.
+"""
+import logging
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RANK_BY = ('video_resolution', 'video_codec')
+DEFAULT_ORDERS = {
+    'video_resolution': ('8k', '4k', '2160', '1440', '1080', '720', '576', '480', 'sd'),
+    'video_codec': ('av1', 'hevc', 'h265', 'vp9', 'h264', 'vc1', 'mpeg4', 'mpeg2video'),
+    'audio_codec': ('truehd', 'dts-hd ma', 'eac3', 'dca', 'dts', 'ac3', 'flac', 'aac', 'mp3'),
+}
+PART_FIELDS = ('file', 'file_size', 'video_resolution', 'video_codec', 'audio_codec')
+
+
+def config_list(value):
+    """Split a comma separated config value into lower case items"""
+    return tuple(item.strip().lower() for item in value.split(',') if item.strip())
+
+
+class DuplicatePolicy:
+    """Decide which Plex copies of a duplicate group to discard without prompting"""
+
+    def __init__(self, rank_by=DEFAULT_RANK_BY, orders=None, action='trash'):
+        self.rank_by = tuple(rank_by)
+        self.action = action
+        # Best value first; unknown values rank below every listed one
+        self.ranks = {
+            field: {value: len(order) - i for i, value in enumerate(order)}
+            for field, order in {**DEFAULT_ORDERS, **(orders or {})}.items()
+        }
+
+    @classmethod
+    def from_config(cls, config, section='Policy'):
+        """Build a policy from the [Policy] section of a config file"""
+        orders = {
+            field: config_list(config.get(section, option))
+            for field, option in [('video_resolution', 'Resolutions'),
+                                  ('video_codec', 'VideoCodecs'),
+                                  ('audio_codec', 'AudioCodecs')]
+            if config.has_option(section, option)
+        }
+        rank_by = config_list(config.get(section, 'RankBy', fallback=','.join(DEFAULT_RANK_BY)))
+        action = config.get(section, 'Action', fallback='trash').strip().lower()
+        if action not in ('trash', 'delete'):
+            raise ValueError(f"Policy Action must be 'trash' or 'delete', not '{action}'")
+        return cls(rank_by, orders, action)
+
+    def file_rank(self, attributes):
+        """Comparable rank of one file, higher is better"""
+        rank = []
+        for field in self.rank_by:
+            value = attributes.get(field)
+            if field == 'file_size':
+                rank.append(value or 0)
+            else:
+                rank.append(self.ranks.get(field, {}).get(str(value).lower(), 0))
+        return tuple(rank)
+
+    @staticmethod
+    def file_attributes(media_info):
+        """Map each Plex file path to its own size and codecs"""
+        parts = media_info.get('parts') or []
+        if parts:
+            return {part[0]: dict(zip(PART_FIELDS, part)) for part in parts}
+        # Records cached before per-file details were kept only have item-level values
+        return {file: {field: media_info.get(field) for field in PART_FIELDS} for file in media_info.get('file') or []}
+
+    def evaluate(self, plex_files, arr_file, media_info, same_file):
+        """Return (files to discard, reason) for one duplicate group"""
+        attributes = self.file_attributes(media_info)
+        managed = [file for file in plex_files if same_file(file, arr_file)]
+        if not managed:
+            return [], 'managed file not in Plex'
+
+        managed_rank = self.file_rank(attributes.get(str(managed[0]), {}))
+        discard = []
+        kept_better = 0
+        for file in plex_files:
+            if file in managed:
+                continue
+            if self.file_rank(attributes.get(str(file), {})) > managed_rank:
+                kept_better += 1
+            else:
+                discard.append(file)
+        return discard, 'better copy kept' if kept_better else 'discard'
+
+    def apply(self, files_to_delete, same_file):
+        """Evaluate every group and return only the ones with files to discard
+
+        The returned groups keep the managed file in their Plex file list so
+        the usual same_file checks still skip it.
+        """
+        decisions = Counter()
+        selected = []
+        for title, plex_files, arr_file, media_info in files_to_delete:
+            discard, reason = self.evaluate(plex_files, arr_file, media_info, same_file)
+            decisions[reason] += 1
+            media_info['decision'] = reason
+            if discard:
+                kept = [file for file in plex_files if same_file(file, arr_file)]
+                selected.append((title, kept + discard, arr_file, media_info))
+        log.info(f"Policy selected {len(selected)} of {len(files_to_delete)} groups: {dict(decisions)}")
+        return selected
@@ -0,0 +1,92 @@
+"""Structured dry-run reports for the Phasarr duplicate cleaners.
+
+Each duplicate group becomes one JSON lines or CSV row with a fixed set of
+columns. Rows are built from the duplicate groups the cleaner already holds
+and written one at a time, so the report adds no second in-memory copy of
+them, and the files load straight into pandas or SQLite.
+"""
+import csv
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+REPORT_FIELDS = (
+    'instance', 'plex_id', 'guids', 'title', 'year', 'matched_by', 'arr_path',
+    'discard_paths', 'discard_count', 'discard_bytes', 'total_bytes',
+    'video_resolution', 'video_codec', 'audio_codec', 'verification', 'decision',
+)
+REPORT_FORMATS = ('jsonl', 'csv')
+
+
+def file_sizes(media_info):
+    """Map each Plex file path to its size"""
+    parts = media_info.get('parts') or []
+    if parts:
+        return {part[0]: part[1] for part in parts}
+    files = media_info.get('file') or []
+    return {files[0]: media_info.get('file_size', 0)} if len(files) == 1 else {}
+
+
+def report_row(instance, plex_files, arr_file, media_info, same_file):
+    """Build the fixed-column report row for one duplicate group"""
+    sizes = file_sizes(media_info)
+    discard = [str(file) for file in plex_files if not same_file(file, arr_file)]
+    verification = media_info.get('verification') or {}
+    return {
+        'instance': instance,
+        'plex_id': media_info.get('id'),
+        'guids': list(media_info.get('guids') or []),
+        'title': media_info.get('title'),
+        'year': media_info.get('year'),
+        'matched_by': media_info.get('matched_by'),
+        'arr_path': str(arr_file),
+        'discard_paths': discard,
+        'discard_count': len(discard),
+        'discard_bytes': sum(sizes.get(file, 0) for file in discard),
+        'total_bytes': media_info.get('file_size', 0),
+        'video_resolution': media_info.get('video_resolution'),
+        'video_codec': media_info.get('video_codec'),
+        'audio_codec': media_info.get('audio_codec'),
+        'verification': [verification.get(file, 'unverified') for file in discard],
+        'decision': media_info.get('decision') or 'discard',
+    }
+
+
+class ReportWriter:
+    """Stream report rows to a JSON lines or CSV file"""
+
+    def __init__(self, path, report_format='jsonl'):
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"Report format must be one of {', '.join(REPORT_FORMATS)}, not '{report_format}'")
+        self.path = path
+        self.format = report_format
+        self.rows = 0
+        self.file = open(path, 'w', newline='')
+        if self.format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=REPORT_FIELDS)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == 'csv':
+            # Lists are joined with '|' so every CSV column stays scalar
+            self.writer.writerow({key: '|'.join(map(str, value)) if isinstance(value, list) else value
+                                  for key, value in row.items()})
+        else:
+            self.file.write(json.dumps(row) + '\n')
+        self.rows += 1
+
+    def write_groups(self, instance, files_to_delete, same_file):
+        """Write one row per (title, plex_files, arr_file, media_info) group"""
+        for _, plex_files, arr_file, media_info in files_to_delete:
+            self.write(report_row(instance, plex_files, arr_file, media_info, same_file))
+
+    def close(self):
+        self.file.close()
+        log.info(f"Wrote {self.rows} rows to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,188 @@
+"""Content verification of Phasarr duplicate groups.
+
+Plex groups duplicates by title, so before anything is disposed of each Plex
+copy is checked against the Radarr/Sonarr file:
+
+- Same device and inode: the copy is a hardlink of the managed file (or a
+  symlink to it) and is never disposed of, as that would free no space and
+  could remove the managed file's data.
+- Different size: the files differ, no hashing needed.
+- Same size: a partial hash of the size, head and tail decides whether the
+  content is identical.
+- Either file unreachable: the copy is unverified, and the cleaners never
+  dispose of it in policy or permanent delete runs.
+
+The managed file is read through the Plex part that maps to it, so path
+mappings between Plex and Radarr/Sonarr do not hide hardlinks.
+
+Partial hashes are cached in a SQLite index keyed by (device, inode, mtime,
+size), so unchanged files are never read twice, and uncached files are hashed
+by a thread pool.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+log = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def partial_hash(path, size):
+    """Hash the size, first and last chunk of a file"""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(HASH_CHUNK_SIZE))
+        if size > 2 * HASH_CHUNK_SIZE:
+            f.seek(-HASH_CHUNK_SIZE, os.SEEK_END)
+            digest.update(f.read(HASH_CHUNK_SIZE))
+        elif size > HASH_CHUNK_SIZE:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class HashIndex:
+    """On-disk cache of partial hashes keyed by (device, inode, mtime, size)"""
+
+    def __init__(self, path, workers=4):
+        self.path = path
+        self.workers = workers
+
+    def open(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (dev, inode)
+            )
+        """)
+        return conn
+
+    def hashes(self, stats):
+        """Partial hash for each {path: stat} entry, reading only files not in the index"""
+        results = {}
+        with closing(self.open()) as conn, conn:
+            missing = {}
+            for path, stat in stats.items():
+                row = conn.execute(
+                    "SELECT hash FROM hashes WHERE dev = ? AND inode = ? AND mtime = ? AND size = ?",
+                    (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                ).fetchone()
+                if row:
+                    results[path] = row[0]
+                else:
+                    missing[path] = stat
+
+            if missing:
+                log.info(f"Hashing {len(missing)} files ({len(results)} cached) with {self.workers} workers...")
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = {path: executor.submit(partial_hash, path, stat.st_size) for path, stat in missing.items()}
+                rows = []
+                for path, future in futures.items():
+                    try:
+                        results[path] = future.result()
+                    except OSError as e:
+                        log.warning(f"Failed to hash {path}: {str(e)}")
+                        continue
+                    stat = missing[path]
+                    rows.append((stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size, results[path]))
+                conn.executemany("INSERT OR REPLACE INTO hashes (dev, inode, mtime, size, hash) VALUES (?, ?, ?, ?, ?)", rows)
+        return results
+
+
+def stat_or_none(path):
+    """os.stat, or None when the file cannot be reached"""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def managed_path(plex_files, arr_file, same_file):
+    """Local path of the managed file
+
+    The Radarr/Sonarr path only exists on this host when both apps see the same
+    paths; with path mappings the Plex part that maps to it is the one to read.
+    """
+    return next((file for file in plex_files if same_file(file, arr_file)), arr_file)
+
+
+def verify_duplicates(files_to_delete, same_file, hash_index):
+    """Check every Plex copy against the managed file and drop hardlinks
+
+    Each group's media info gets a 'verification' map of Plex file to one of
+    hardlink, identical, different or unverified. Groups left with nothing to
+    dispose of are removed. Same-size copies are only hashed when a hash index
+    is given.
+    """
+    stats = {}
+    for _, plex_files, arr_file, _ in files_to_delete:
+        for path in [managed_path(plex_files, arr_file, same_file), *plex_files]:
+            if str(path) not in stats:
+                stats[str(path)] = stat_or_none(path)
+
+    # Only same-size copies can be identical, so only those are hashed
+    to_hash = {}
+    for _, plex_files, arr_file, _ in files_to_delete:
+        managed_file = managed_path(plex_files, arr_file, same_file)
+        managed = stats[str(managed_file)]
+        for file in plex_files:
+            stat = stats[str(file)]
+            if managed and stat and stat.st_size == managed.st_size and \
+                    (stat.st_dev, stat.st_ino) != (managed.st_dev, managed.st_ino):
+                to_hash[str(file)] = stat
+                to_hash[str(managed_file)] = managed
+    hashes = hash_index.hashes(to_hash) if to_hash and hash_index else {}
+
+    verified = []
+    results = Counter()
+    for title, plex_files, arr_file, media_info in files_to_delete:
+        managed_file = managed_path(plex_files, arr_file, same_file)
+        managed = stats[str(managed_file)]
+        verification = {}
+        kept = []
+        for file in plex_files:
+            stat = stats[str(file)]
+            if same_file(file, arr_file):
+                kept.append(file)
+                continue
+            if not managed or not stat:
+                status = 'unverified'
+            elif (stat.st_dev, stat.st_ino) == (managed.st_dev, managed.st_ino):
+                status = 'hardlink'
+            elif stat.st_size != managed.st_size:
+                status = 'different'
+            elif not hashes.get(str(file)) or not hashes.get(str(managed_file)):
+                status = 'unverified'
+            elif hashes[str(file)] == hashes[str(managed_file)]:
+                status = 'identical'
+            else:
+                status = 'different'
+            verification[str(file)] = status
+            results[status] += 1
+            if status == 'hardlink':
+                log.info(f"Keeping {file}: it is a hardlink of {arr_file}")
+            else:
+                kept.append(file)
+        media_info['verification'] = verification
+        if any(not same_file(file, arr_file) for file in kept):
+            verified.append((title, kept, arr_file, media_info))
+
+    log.info(f"Verified {sum(results.values())} Plex copies: {dict(results)}")
+    if results['unverified']:
+        log.warning(f"{results['unverified']} Plex copies could not be checked against the managed file; "
+                    f"they are kept in unattended and permanent delete runs")
+    return verified
+
+
+def is_unverified(media_info, file):
+    """Whether a Plex copy could not be checked against the managed file"""
+    return (media_info.get('verification') or {}).get(str(file), 'unverified') == 'unverified'
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Set
+
+import ijson
+from dotenv import load_dotenv
+from requests.exceptions import RequestException
+
+# The shared HTTP client lives in Common/ at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'Common'))
+from arr_client import ArrClient
+
+# Load environment variables
+load_dotenv()
+
+# Health check source, external ID, item endpoint and bulk editor ID list of each app
+APPS = {
+    "RADARR": {
+        "enabled": "ENABLE_INVALID_MOVIES_AUTO_CLEANER", "health_source": "RemovedMovieCheck",
+        "id_pattern": re.compile(r"tmdbid (\d+)", re.IGNORECASE), "id_field": "tmdbId",
+        "endpoint": "movie", "editor_ids": "movieIds",
+    },
+    "SONARR": {
+        "enabled": "ENABLE_INVALID_SERIES_AUTO_CLEANER", "health_source": "RemovedSeriesCheck",
+        "id_pattern": re.compile(r"tvdbid (\d+)", re.IGNORECASE), "id_field": "tvdbId",
+        "endpoint": "series", "editor_ids": "seriesIds",
+    },
+}
+
+# Script settings
+INVALID_CLEANER_INTERVAL = os.getenv("INVALID_CLEANER_INTERVAL", "1h")  # sleep(1) style: 3600, 60m, 1h or 1d
+DRY_RUN = os.getenv("DRY_RUN", "false").lower() == "true"
+RUN_ONCE = os.getenv("RUN_ONCE", "false").lower() == "true"  # Exit after one pass over every instance
+DELETE_WORKERS = int(os.getenv("DELETE_WORKERS", 4))  # Concurrent deletes when the bulk editor is unavailable
+
+# Shared HTTP client settings
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", 60))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", 0))  # Requests per second per instance, 0 to disable
+
+client = ArrClient(timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, rate_limit=RATE_LIMIT or None, pool_size=DELETE_WORKERS)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def parse_interval(interval: str) -> int:
+    """Converts a sleep(1) style duration such as 1h into seconds."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", interval)
+    if not match:
+        raise ValueError(f"Invalid duration: {interval}")
+    return int(float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)])
+
+
+def load_instances() -> List[Dict]:
+    """Builds the instance list of every enabled app from <APP>_INSTANCES and <APP>_<name>_URL/_API_KEY."""
+    instances = []
+    for app, settings in APPS.items():
+        if os.getenv(settings["enabled"], "false").lower() != "true":
+            logger.info(f"{app.title()} cleaning is not enabled. Set {settings['enabled']} to 'true' in the .env file to enable it.")
+            continue
+        for name in os.getenv(f"{app}_INSTANCES", "").split():
+            url = os.getenv(f"{app}_{name}_URL")
+            api_key = os.getenv(f"{app}_{name}_API_KEY")
+            if not url or not api_key:
+                logger.warning(f"{name} is missing URL or API key. This instance will be skipped.")
+                continue
+            logger.info(f"{app.title()} instance configured: {name}")
+            instances.append({
+                "app": app, "name": name, "label": f"{app.title()} {name}", "url": url.rstrip("/"), "api_key": api_key, **settings
+            })
+    return instances
+
+
+def get_invalid_ids(instance: Dict) -> Set[int]:
+    """Returns the TMDb/TVDb IDs that the health check reports as removed from the metadata source."""
+    response = client.get(f"{instance['url']}/api/v3/health", headers={"X-Api-Key": instance['api_key']})
+    response.raise_for_status()
+    return {
+        int(external_id)
+        for check in response.json() if check.get("source") == instance["health_source"] and check.get("type") == "error"
+        for external_id in instance["id_pattern"].findall(check.get("message") or "")
+    }
+
+
+def index_items(instance: Dict, external_ids: Set[int]) -> Dict[int, Dict]:
+    """Streams the movie or series list once and indexes the items with the given TMDb/TVDb IDs."""
+    response = client.get(f"{instance['url']}/api/v3/{instance['endpoint']}", headers={"X-Api-Key": instance['api_key']}, stream=True)
+    response.raise_for_status()
+    # Parse the list one item at a time so only the matching items stay in memory
+    response.raw.decode_content = True
+    return {
+        item[instance["id_field"]]: {"id": item["id"], "title": item.get("title"), "path": item.get("path")}
+        for item in ijson.items(response.raw, "item", use_float=True) if item.get(instance["id_field"]) in external_ids
+    }
+
+
+def delete_items(instance: Dict, item_ids: List[int]) -> int:
+    """Deletes items and their files with the bulk editor, or one by one when the editor is not available; returns the count deleted."""
+    headers = {"X-Api-Key": instance['api_key']}
+    response = client.delete(
+        f"{instance['url']}/api/v3/{instance['endpoint']}/editor",
+        json={instance["editor_ids"]: item_ids, "deleteFiles": True}, headers=headers
+    )
+    if response.status_code not in (404, 405):
+        response.raise_for_status()
+        return len(item_ids)
+
+    logger.info(f"{instance['label']}: Bulk editor not available, deleting {len(item_ids)} items with {DELETE_WORKERS} workers")
+
+    def delete_item(item_id):
+        try:
+            response = client.delete(f"{instance['url']}/api/v3/{instance['endpoint']}/{item_id}",
+                                     params={"deleteFiles": "true"}, headers=headers)
+            response.raise_for_status()
+            return True
+        except RequestException as e:
+            logger.error(f"{instance['label']}: Error deleting {instance['endpoint']} {item_id}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+        return sum(executor.map(delete_item, item_ids))
+
+
+def clean_instance(instance: Dict) -> None:
+    """Removes and deletes every item the health check reports as removed from TMDb/TVDb."""
+    external_ids = get_invalid_ids(instance)
+    if not external_ids:
+        logger.info(f"{instance['label']}: No invalid {instance['endpoint']} ({instance['id_field']}) reported by the health check, skipping...")
+        return
+
+    index = index_items(instance, external_ids)
+    for external_id in sorted(external_ids - set(index)):
+        logger.warning(f"{instance['label']}: {instance['id_field']} {external_id} from the health check is not in the library")
+    for external_id, item in sorted(index.items()):
+        logger.info(f"{instance['label']}: {item['id']} :: {item['title']} :: {item['path']} :: "
+                    f"Removing and deleting invalid {instance['endpoint']} ({instance['id_field']}: {external_id})")
+    if not index:
+        return
+    if DRY_RUN:
+        logger.info(f"[DRY RUN] Would remove and delete {len(index)} invalid {instance['endpoint']} items in {instance['label']}")
+        return
+
+    deleted = delete_items(instance, sorted(item["id"] for item in index.values()))
+    logger.info(f"{instance['label']}: Removed and deleted {deleted} of {len(index)} invalid {instance['endpoint']} items")
+
+
+async def clean_all_instances(instances: List[Dict]) -> None:
+    """Cleans every instance concurrently; a failing instance does not stop the others."""
+    loop = asyncio.get_running_loop()
+    # The HTTP calls are blocking, so each instance runs in the default executor
+    results = await asyncio.gather(*(loop.run_in_executor(None, clean_instance, instance) for instance in instances), return_exceptions=True)
+    for instance, result in zip(instances, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing {instance['label']} ({instance['url']}): {result}")
+
+
+def main():
+    """Main function to execute the script."""
+    instances = load_instances()
+    if not instances:
+        logger.error("No enabled Radarr or Sonarr instances configured. Exiting.")
+        sys.exit(1)
+    interval = parse_interval(INVALID_CLEANER_INTERVAL)
+    if DRY_RUN:
+        logger.info("Running in DRY RUN mode. No changes will be made.")
+
+    while True:
+        logger.info("Starting invalid item cleaner...")
+        asyncio.run(clean_all_instances(instances))
+        if RUN_ONCE:
+            break
+        logger.info(f"Invalid item cleaner completed. Sleeping for {INVALID_CLEANER_INTERVAL}...")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
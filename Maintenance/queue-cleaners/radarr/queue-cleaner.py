@@ -0,0 +1,295 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from requests.exceptions import RequestException
+
+# The shared HTTP client lives in Common/ at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / 'Common'))
+from arr_client import ArrClient
+
+# Load environment variables, from the same .env file as queue_cleaner.sh
+load_dotenv()
+
+# API version of each app, the queue record field holding the ID to search again, and the
+# search command that takes a list of those IDs, so one command covers the whole instance
+APPS = {
+    "RADARR": {"api_version": "v3", "id_field": "movieId", "search_command": "MoviesSearch", "search_ids": "movieIds"},
+    "SONARR": {"api_version": "v3", "id_field": "episodeId", "search_command": "EpisodeSearch", "search_ids": "episodeIds"},
+    "READARR": {"api_version": "v1", "id_field": "bookId", "search_command": "BookSearch", "search_ids": "bookIds"},
+    "LIDARR": {"api_version": "v1", "id_field": "albumId", "search_command": "AlbumSearch", "search_ids": "albumIds"},
+}
+
+# Script settings
+ENABLE_QUEUE_CLEANER = os.getenv("ENABLE_QUEUE_CLEANER", "false").lower() == "true"
+QUEUE_CLEANER_INTERVAL = os.getenv("QUEUE_CLEANER_INTERVAL", "15m")  # sleep(1) style: 900, 900s, 15m, 1h or 1d
+DRY_RUN = os.getenv("DRY_RUN", "false").lower() == "true"
+RUN_ONCE = os.getenv("RUN_ONCE", "false").lower() == "true"  # Exit after one pass over every instance
+QUEUE_PAGE_SIZE = int(os.getenv("QUEUE_PAGE_SIZE", 1000))
+QUEUE_BULK_SIZE = int(os.getenv("QUEUE_BULK_SIZE", 1000))  # Queue items removed per bulk request
+
+# Stall detection settings: flag downloads that stay slow for a whole window, before the client gives up
+STALL_DETECTION = os.getenv("STALL_DETECTION", "false").lower() == "true"
+STALL_WINDOW = os.getenv("STALL_WINDOW", "6h")  # How long a download must stay below the minimum speed
+STALL_MIN_SPEED = float(os.getenv("STALL_MIN_SPEED", 10))  # Minimum average speed over the window, in KiB/s
+STALL_HISTORY_FILE = os.getenv("STALL_HISTORY_FILE", "queue_history.json")  # Progress samples kept across restarts
+
+# Shared HTTP client settings
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", 30))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", 0))  # Requests per second per instance, 0 to disable
+
+client = ArrClient(timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, rate_limit=RATE_LIMIT or None)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def parse_interval(interval: str) -> int:
+    """Converts a sleep(1) style duration such as 15m into seconds."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", interval)
+    if not match:
+        raise ValueError(f"Invalid duration: {interval}")
+    return int(float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)])
+
+
+def load_instances() -> List[Dict]:
+    """Builds the instance list from <APP>_INSTANCES and the <APP>_<name>_URL/_API_KEY variables."""
+    instances = []
+    for app in APPS:
+        names = os.getenv(f"{app}_INSTANCES", "").split()
+        if not names:
+            logger.warning(f"No {app.title()} instances defined. {app.title()} functionality will be disabled.")
+        for name in names:
+            url = os.getenv(f"{app}_{name}_URL")
+            api_key = os.getenv(f"{app}_{name}_API_KEY")
+            if not url or not api_key:
+                logger.warning(f"{name} is missing URL or API key. This instance will be skipped.")
+                continue
+            logger.info(f"{app.title()} instance configured: {name}")
+            instances.append({
+                "app": app, "name": name, "label": f"{app.title()} {name}", "url": url.rstrip("/"), "api_key": api_key, **APPS[app]
+            })
+    return instances
+
+
+def classify(record: Dict) -> Optional[str]:
+    """Returns why a queue record is problematic (warning, failed or stalled), or None when it is fine."""
+    status = (record.get("status") or "").lower()
+    if status == "completed" and (record.get("trackedDownloadStatus") or "").lower() == "warning":
+        return "warning"
+    if status in ("failed", "stalled"):
+        return status
+    return None
+
+
+def format_duration(seconds: float) -> str:
+    """Formats seconds as the largest fitting unit, e.g. 6.0h."""
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{seconds / size:.1f}{unit}"
+    return f"{seconds:.0f}s"
+
+
+class StallDetector:
+    """Keeps the last window of (sizeleft, timestamp) samples per downloading queue item across polls."""
+
+    def __init__(self, window: int, min_speed: float, path: Optional[str] = None):
+        self.window = window
+        self.min_speed = min_speed
+        self.path = path
+        self.lock = threading.Lock()
+        self.history = {}  # Instance URL -> queue ID -> {"size": bytes, "samples": deque}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for url, items in json.load(f).items():
+                    self.history[url] = {
+                        int(queue_id): {"size": item["size"], "samples": deque(map(tuple, item["samples"]))}
+                        for queue_id, item in items.items()
+                    }
+
+    def observe(self, instance: Dict, record: Dict, now: float) -> Optional[str]:
+        """Adds a sample for a queue record; returns a reason when its speed stayed below the minimum for the whole window."""
+        with self.lock:
+            items = self.history.setdefault(instance["url"], {})
+        if (record.get("status") or "").lower() != "downloading" or not record.get("size"):
+            # Paused or queued downloads are not slow, so their history starts over when they resume
+            items.pop(record["id"], None)
+            return None
+
+        item = items.get(record["id"])
+        if item is None or item["size"] != record["size"]:
+            # A new download, or a different release under a reused queue ID
+            item = items[record["id"]] = {"size": record["size"], "samples": deque()}
+        samples = item["samples"]
+        samples.append((record["sizeleft"], now))
+        # Samples are dropped by age rather than count, so cron runs more frequent than the
+        # interval still keep a full window; only the newest one older than the window is kept
+        while len(samples) > 1 and now - samples[1][1] >= self.window:
+            samples.popleft()
+
+        # Compare with the newest sample that is at least a full window old
+        start = samples[0] if now - samples[0][1] >= self.window else None
+        if start is None:
+            return None
+        speed = (start[0] - record["sizeleft"]) / (now - start[1])
+        if speed >= self.min_speed * 1024:
+            return None
+        eta = format_duration(record["sizeleft"] / speed) if speed > 0 else "never"
+        return f"slow: {speed / 1024:.1f} KiB/s over {format_duration(now - start[1])}, ETA {eta}"
+
+    def prune(self, instance: Dict, queue_ids: set) -> None:
+        """Forgets items that have left the queue."""
+        with self.lock:
+            items = self.history.get(instance["url"], {})
+            for queue_id in set(items) - queue_ids:
+                del items[queue_id]
+
+    def save(self) -> None:
+        """Writes the samples to the history file so they survive restarts and RUN_ONCE runs."""
+        if not self.path:
+            return
+        with self.lock:
+            data = {
+                url: {queue_id: {"size": item["size"], "samples": list(item["samples"])} for queue_id, item in items.items()}
+                for url, items in self.history.items()
+            }
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+
+
+def fetch_problem_records(instance: Dict, stall_detector: Optional[StallDetector] = None) -> Dict[int, Dict]:
+    """Pages through the whole queue, classifying each record as it arrives; returns the problematic records by queue ID."""
+    url = f"{instance['url']}/api/{instance['api_version']}/queue"
+    headers = {"X-Api-Key": instance['api_key']}
+    problems = {}
+    queue_ids = set()
+    now = time.time()
+    seen = 0
+    page = 1
+
+    while True:
+        params = {"page": page, "pageSize": QUEUE_PAGE_SIZE, "includeUnknownItems": "true"}
+        response = client.get(url, params=params, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        for record in data["records"]:
+            queue_ids.add(record["id"])
+            slow = stall_detector.observe(instance, record, now) if stall_detector else None
+            reason = classify(record) or slow
+            if reason:
+                # Keyed by queue ID, so a record that moves between pages while paging is only handled once
+                problems[record["id"]] = {**record, "reason": reason}
+        seen += len(data["records"])
+        if seen >= data["totalRecords"] or not data["records"]:
+            break
+        page += 1
+
+    if stall_detector:
+        stall_detector.prune(instance, queue_ids)
+    logger.info(f"{instance['label']}: {data['totalRecords']} items in queue, "
+                f"{len(problems)} problematic, {page} pages fetched")
+    return problems
+
+
+def remove_queue_items(instance: Dict, queue_ids: List[int]) -> List[int]:
+    """Removes queue items from the download client and blocklists their releases, QUEUE_BULK_SIZE per request; returns the removed IDs."""
+    url = f"{instance['url']}/api/{instance['api_version']}/queue/bulk"
+    params = {"removeFromClient": "true", "blocklist": "true"}
+    removed = []
+    for start in range(0, len(queue_ids), QUEUE_BULK_SIZE):
+        chunk = queue_ids[start:start + QUEUE_BULK_SIZE]
+        try:
+            response = client.delete(url, params=params, json={"ids": chunk}, headers={"X-Api-Key": instance['api_key']})
+            response.raise_for_status()
+            removed.extend(chunk)
+        except RequestException as e:
+            logger.error(f"{instance['label']}: Error removing {len(chunk)} queue items: {e}")
+    return removed
+
+
+def search_items(instance: Dict, item_ids: List[int]) -> bool:
+    """Triggers one search command covering every given movie, episode, book or album."""
+    payload = {"name": instance["search_command"], instance["search_ids"]: item_ids}
+    url = f"{instance['url']}/api/{instance['api_version']}/command"
+    try:
+        response = client.post(url, json=payload, headers={"X-Api-Key": instance['api_key']})
+        response.raise_for_status()
+        return True
+    except RequestException as e:
+        logger.error(f"{instance['label']}: Failed to trigger {instance['search_command']} for {len(item_ids)} items: {e}")
+        return False
+
+
+def clean_instance(instance: Dict, stall_detector: Optional[StallDetector] = None) -> None:
+    """Removes every problematic queue item of one instance in bulk and searches their items again with one command."""
+    problems = fetch_problem_records(instance, stall_detector)
+    if not problems:
+        return
+
+    for record in problems.values():
+        logger.info(f"{instance['label']}: Problematic queue item ({record['reason']}): {record['id']} ({record.get('title')})")
+    if DRY_RUN:
+        logger.info(f"[DRY RUN] Would remove and blocklist {len(problems)} queue items in {instance['label']} and search their items again")
+        return
+
+    removed = remove_queue_items(instance, sorted(problems))
+    # Several queue items can belong to the same movie, episode, book or album; search each one once
+    item_ids = sorted({problems[queue_id][instance["id_field"]] for queue_id in removed if problems[queue_id].get(instance["id_field"])})
+    searched = bool(item_ids) and search_items(instance, item_ids)
+    logger.info(f"{instance['label']}: Removed and blocklisted {len(removed)} of {len(problems)} problematic items, "
+                f"{instance['search_command']} for {len(item_ids)} items {'triggered' if searched else 'not triggered'}")
+
+
+async def clean_all_instances(instances: List[Dict], stall_detector: Optional[StallDetector] = None) -> None:
+    """Cleans every instance concurrently; a failing instance does not stop the others."""
+    loop = asyncio.get_running_loop()
+    # The HTTP calls are blocking, so each instance runs in the default executor
+    results = await asyncio.gather(
+        *(loop.run_in_executor(None, clean_instance, instance, stall_detector) for instance in instances), return_exceptions=True
+    )
+    for instance, result in zip(instances, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing {instance['label']} ({instance['url']}): {result}")
+
+
+def main():
+    """Main function to execute the script."""
+    if not ENABLE_QUEUE_CLEANER:
+        logger.info('Script is not enabled. Set ENABLE_QUEUE_CLEANER to "true" in the ".env" file to enable.')
+        return
+    instances = load_instances()
+    if not instances:
+        logger.error("No valid Radarr, Sonarr, Readarr, or Lidarr instances configured. Exiting.")
+        sys.exit(1)
+    interval = parse_interval(QUEUE_CLEANER_INTERVAL)
+    if DRY_RUN:
+        logger.info("Running in DRY RUN mode. No changes will be made.")
+    stall_detector = None
+    if STALL_DETECTION:
+        stall_detector = StallDetector(parse_interval(STALL_WINDOW), STALL_MIN_SPEED, STALL_HISTORY_FILE)
+        logger.info(f"Stall detection enabled: downloads below {STALL_MIN_SPEED} KiB/s for {STALL_WINDOW} will be removed.")
+
+    while True:
+        logger.info("Starting Queue Cleaner process...")
+        asyncio.run(clean_all_instances(instances, stall_detector))
+        if stall_detector:
+            stall_detector.save()
+        if RUN_ONCE:
+            break
+        logger.info(f"Queue Cleaner process completed. Sleeping for {QUEUE_CLEANER_INTERVAL}...")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
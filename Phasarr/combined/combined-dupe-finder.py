@@ -4,15 +4,31 @@ import logging
 import time
 import argparse
 import configparser
-import shutil
-from datetime import datetime
+import functools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
+from xml.etree import ElementTree
 
+from plexapi import utils
 from plexapi.server import PlexServer
+import ijson
 import requests
 from tqdm import tqdm
 from colorama import init, Fore, Style
 
+# The shared HTTP client lives in Common/ at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'Common'))
+from analytics import ReclaimableSpace
+from arr_client import ArrClient
+from disposal import dispose_files, restore_files
+from inventory import InventoryCache, MediaInfo
+from matching import FileMatcher
+from policy import DuplicatePolicy
+from report import ReportWriter
+from verification import HashIndex, is_unverified, verify_duplicates
+
 # Initialize colorama
 init(autoreset=True)
 
@@ -38,7 +54,13 @@ def load_config(config_file):
 # Set up argument parser
 parser = argparse.ArgumentParser(description="Manage duplicate files between Plex, Radarr, and Sonarr instances")
 parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without processing any files")
+parser.add_argument("--policy", action="store_true", help="Decide with the [Policy] rules instead of prompting, for unattended runs")
+parser.add_argument("--analytics", action="store_true", help="Report the reclaimable space per instance, library, resolution and codec without processing any files")
+parser.add_argument("--restore", action="store_true", help="Move every file in the restore index back out of the trash and exit")
 parser.add_argument("--config", "-c", default="config.ini", help="Specify the configuration file (default: config.ini)")
+parser.add_argument("--verify-paths", action="store_true", help="Resolve symlinks on the filesystem when comparing Plex and Radarr/Sonarr paths")
+parser.add_argument("--refresh-cache", action="store_true", help="Ignore the inventory cache and fetch every library in full")
+parser.add_argument("--cache-ttl", type=int, help="Seconds before a cached snapshot needs a full refresh (default: Cache.TTL or 86400)")
 args = parser.parse_args()
 
 # Load configuration
@@ -52,6 +74,8 @@ log = logging.getLogger("Plex_Radarr_Sonarr_DupeManager")
 # Plex configuration
 PLEX_URL = config.get('Plex', 'URL')
 PLEX_TOKEN = config.get('Plex', 'Token')
+PLEX_PAGE_SIZE = config.getint('Plex', 'PageSize', fallback=1000)
+PLEX_LEAN_FETCH = config.getboolean('Plex', 'LeanFetch', fallback=True)
 
 # Radarr and Sonarr instances configuration
 radarr_instances = {}
@@ -73,6 +97,45 @@ for section in config.sections():
         }
 
 TRASH_DIR = Path(config.get('General', 'TrashDirectory', fallback='./trash'))
+SCAN_WORKERS = config.getint('General', 'ScanWorkers', fallback=4)
+FETCH_WORKERS = config.getint('General', 'FetchWorkers', fallback=8)
+DISPOSAL_WORKERS = config.getint('General', 'DisposalWorkers', fallback=4)
+PER_MOUNT_TRASH = config.getboolean('General', 'PerMountTrash', fallback=True)
+RESTORE_INDEX = config.get('General', 'RestoreIndex', fallback='phasarr_restore.jsonl')
+
+# Hardlinks of the managed file are always kept; same-size copies are partially hashed
+hash_index = HashIndex(
+    config.get('General', 'HashIndex', fallback='phasarr_hashes.db'),
+    workers=config.getint('General', 'HashWorkers', fallback=4)
+) if config.getboolean('General', 'HashContent', fallback=True) else None
+
+# Dry run reports are written as jsonl or csv
+REPORT_FORMAT = config.get('General', 'ReportFormat', fallback='jsonl').strip().lower()
+
+# Keep/discard policy for unattended runs
+USE_POLICY = args.policy or config.getboolean('Policy', 'Enabled', fallback=False)
+POLICY = DuplicatePolicy.from_config(config) if config.has_section('Policy') else DuplicatePolicy()
+
+# Plex to Radarr/Sonarr path prefix mappings and symlink resolution used to match files
+matcher = FileMatcher.from_config(config, verify_paths=args.verify_paths)
+same_file = matcher.same_file
+
+# Shared HTTP client for all Plex and *arr requests
+client = ArrClient(
+    timeout=config.getint('HTTP', 'Timeout', fallback=30),
+    retries=config.getint('HTTP', 'Retries', fallback=3),
+    rate_limit=config.getfloat('HTTP', 'RateLimit', fallback=0) or None,
+    pool_size=max(SCAN_WORKERS, FETCH_WORKERS, 10)
+)
+
+# Inventory cache configuration
+inventory = InventoryCache(
+    config.get('Cache', 'Path', fallback='phasarr_cache.db'),
+    ttl=args.cache_ttl if args.cache_ttl is not None else config.getint('Cache', 'TTL', fallback=86400),
+    refresh=args.refresh_cache
+)
+# Changed items refetched one by one before a snapshot is refreshed with a full fetch instead
+REFRESH_LIMIT = config.getint('Cache', 'RefreshLimit', fallback=500)
 
 # Create trash directory if it doesn't exist
 TRASH_DIR.mkdir(parents=True, exist_ok=True)
@@ -85,73 +148,274 @@ except Exception as e:
     print(f"Exception connecting to {PLEX_URL}: {str(e)}")
     sys.exit(1)
 
+def parse_plex_item(elem):
+    """Build a media info record from a streamed Plex Video element"""
+    info = MediaInfo(
+        id=int(elem.get('ratingKey')),
+        title=elem.get('title'),
+        year=int(elem.get('year')) if elem.get('year') else None,
+        guids=[guid.get('id') for guid in elem.iter('Guid')],
+        updated=elem.get('updatedAt', '')
+    )
+    for media in elem.iter('Media'):
+        info.video_resolution = media.get('videoResolution') or 'Unknown'
+        info.video_codec = media.get('videoCodec') or 'Unknown'
+        info.audio_codec = media.get('audioCodec') or 'Unknown'
+        for part in media.iter('Part'):
+            size = int(part.get('size') or 0)
+            info.file.append(part.get('file'))
+            info.file_size += size
+            info.parts.append([part.get('file'), size, info.video_resolution, info.video_codec, info.audio_codec])
+    return info
+
+def duplicate_libtype(section):
+    """Plex only reports duplicates on videos, so TV sections are searched by episode"""
+    return 'episode' if section.type == 'show' else section.type
+
+def iter_plex_duplicates(section_key, libtype, since=None):
+    """Stream duplicate items from a Plex library one container window at a time"""
+    params = {'duplicate': 1, 'includeGuids': 1, 'type': utils.searchType(libtype)}
+    if since:
+        params['updatedAt>>'] = int(since)
+    headers = {'X-Plex-Token': PLEX_TOKEN, 'Accept': 'application/xml'}
+    start = 0
+    while True:
+        headers['X-Plex-Container-Start'] = str(start)
+        headers['X-Plex-Container-Size'] = str(PLEX_PAGE_SIZE)
+        response = client.get(f"{PLEX_URL}/library/sections/{section_key}/all", params=params, headers=headers, stream=True, timeout=60)
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        total_size = 0
+        count = 0
+        # Only the Video elements are kept, and each one is cleared as soon as it has been read
+        for event, elem in ElementTree.iterparse(response.raw, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == 'MediaContainer':
+                    total_size = int(elem.get('totalSize', elem.get('size', 0)))
+            elif elem.tag == 'Video':
+                count += 1
+                yield parse_plex_item(elem)
+                elem.clear()
+
+        start += count
+        if count == 0 or start >= total_size:
+            break
+
+def fetch_plex_duplicates(section, since=None):
+    """Fetch duplicate items from a Plex library section as media info records"""
+    fetch_start = time.monotonic()
+    if PLEX_LEAN_FETCH:
+        duplicates = list(iter_plex_duplicates(section.key, duplicate_libtype(section), since))
+    else:
+        filters = {'updatedAt>>': datetime.fromtimestamp(since)} if since else None
+        duplicates = [get_media_info(item) for item in section.search(libtype=duplicate_libtype(section), duplicate=True, filters=filters, includeGuids=True)]
+    fetch_time = time.monotonic() - fetch_start
+    if duplicates:
+        log.info(f"Fetched {len(duplicates)} Plex items from {section.title} in {fetch_time:.1f}s ({fetch_time / len(duplicates) * 10000:.1f}s per 10k items)")
+    return duplicates
+
 def get_plex_duplicates(library_section):
     """Get duplicate items from Plex"""
     log.info(f"Connecting to Plex server and scanning {library_section} library...")
     section = plex.library.section(library_section)
-    duplicates = section.search(duplicate=True)
+    snapshot = inventory.load(PLEX_URL, library_section)
+    sync_start = time.time()
+
+    if snapshot is not None:
+        duplicates = {key: MediaInfo(**row) for key, row in snapshot['items'].items()}
+        changed = {str(info['id']): info for info in fetch_plex_duplicates(section, snapshot['synced_at'])}
+        duplicates.update(changed)
+        # Items that stopped being duplicates are not returned by the updatedAt search,
+        # so only trust the merged snapshot when its size matches what Plex reports
+        container = plex.query(
+            f"/library/sections/{section.key}/all?duplicate=1&type={utils.searchType(duplicate_libtype(section))}",
+            headers={'X-Plex-Container-Start': '0', 'X-Plex-Container-Size': '0'}
+        )
+        if int(container.attrib.get('totalSize', -1)) == len(duplicates):
+            inventory.save(PLEX_URL, library_section, changed, sync_start, snapshot['full_sync_at'])
+            log.info(f"Found {len(duplicates)} items with duplicates in Plex library: {library_section} ({len(changed)} refreshed from Plex)")
+            return list(duplicates.values())
+        log.info(f"Cached duplicates for {library_section} are out of date, rescanning the whole library...")
+
+    duplicates = {str(info['id']): info for info in fetch_plex_duplicates(section)}
+    inventory.save(PLEX_URL, library_section, duplicates, sync_start, sync_start)
     log.info(f"Found {len(duplicates)} items with duplicates in Plex library: {library_section}")
-    return duplicates
+    return list(duplicates.values())
+
+def plex_guids(item):
+    """GUIDs of a Plex item, read from the fetched XML so plexapi does not reload the item"""
+    return [guid.attrib['id'] for guid in item._data.findall('Guid')]
+
+def plex_year(item):
+    """Year of a Plex item, read from the fetched XML so plexapi does not reload the item"""
+    year = item._data.attrib.get('year')
+    return int(year) if year else None
 
 def get_media_info(item):
     """Get media info for a Plex item"""
-    info = {
-        'id': item.ratingKey,
-        'title': item.title,
-        'file': [],
-        'video_resolution': 'Unknown',
-        'video_codec': 'Unknown',
-        'audio_codec': 'Unknown',
-        'file_size': 0
-    }
+    info = MediaInfo(
+        id=item.ratingKey,
+        title=item.title,
+        guids=plex_guids(item),
+        year=plex_year(item),
+        updated=str(item.updatedAt)
+    )
     for media in item.media:
-        for part in media.parts:
-            info['file'].append(part.file)
-            info['file_size'] += part.size if part.size else 0
         info['video_resolution'] = media.videoResolution if media.videoResolution else 'Unknown'
         info['video_codec'] = media.videoCodec if media.videoCodec else 'Unknown'
         info['audio_codec'] = media.audioCodec if media.audioCodec else 'Unknown'
+        for part in media.parts:
+            info['file'].append(part.file)
+            info['file_size'] += part.size if part.size else 0
+            info['parts'].append([part.file, part.size or 0, info['video_resolution'], info['video_codec'], info['audio_codec']])
     return info
 
+def arr_record(item, endpoint):
+    """Reduce a Radarr movie or Sonarr series to the fields used for matching"""
+    if endpoint == 'movie':
+        movie_file = item['movieFile'] if item['hasFile'] else {}
+        return {
+            'id': item['id'],
+            'title': item['title'],
+            'year': item.get('year'),
+            'tmdbId': item.get('tmdbId'),
+            'imdbId': item.get('imdbId'),
+            'path': movie_file.get('path'),
+            'updated': max(item.get('lastInfoSync') or '', item.get('added') or '', movie_file.get('dateAdded') or '')
+        }
+    return {
+        'id': item['id'],
+        'title': item['title'],
+        'episodes': [
+            {
+                'seasonNumber': episode['seasonNumber'],
+                'episodeNumber': episode['episodeNumber'],
+                'tvdbId': episode.get('tvdbId'),
+                'path': episode['episodeFile']['path']
+            }
+            for episode in item.get('episodes', []) if episode.get('hasFile', False)
+        ],
+        'updated': max(item.get('lastInfoSync') or '', item.get('added') or '')
+    }
+
+def with_episodes(url, api_key, series):
+    """Attach the episodes with files to a Sonarr series, which the series endpoints do not include"""
+    series['episodes'] = []
+    if series.get('statistics', {}).get('episodeFileCount', 1) > 0:
+        response = client.get(f"{url}/api/v3/episode", params={'apikey': api_key, 'seriesId': series['id'], 'includeEpisodeFile': 'true'})
+        response.raise_for_status()
+        series['episodes'] = [episode for episode in response.json() if episode.get('hasFile', False)]
+    return series
+
+def fetch_arr_records(url, api_key, endpoint):
+    """Fetch *arr items, only refreshing changed ones when a cached snapshot is available"""
+    params = {'apikey': api_key}
+    snapshot = inventory.load(url, endpoint)
+    sync_start = time.time()
+
+    if snapshot is not None:
+        # Every file import, upgrade or deletion leaves a history event, so the history
+        # since the last sync tells us which movies or series need to be fetched again
+        id_field = 'movieId' if endpoint == 'movie' else 'seriesId'
+        since = datetime.fromtimestamp(snapshot['synced_at'], timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        response = client.get(f"{url}/api/v3/history/since", params={**params, 'date': since})
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"Failed to get history. Status code: {response.status_code}")
+        changed_ids = {str(event[id_field]) for event in response.json() if event.get(id_field)}
+        # Past the cutoff one streamed fetch of the whole list is cheaper than a request per item
+        if len(changed_ids) > REFRESH_LIMIT:
+            log.info(f"{len(changed_ids)} items changed in {url} since the last sync, fetching the full list")
+            snapshot = None
+
+    if snapshot is None:
+        response = client.get(f"{url}/api/v3/{endpoint}", params=params, stream=True)
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"Failed to get items. Status code: {response.status_code}")
+        # Parse the list one item at a time so only the trimmed records stay in memory
+        response.raw.decode_content = True
+        items = ijson.items(response.raw, 'item', use_float=True)
+        if endpoint == 'series':
+            # Sonarr has no bulk endpoint for episode files, so fetch them per series through a bounded pool
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                items = list(executor.map(functools.partial(with_episodes, url, api_key), items))
+        records = {str(item['id']): arr_record(item, endpoint) for item in items}
+        inventory.save(url, endpoint, records, sync_start, sync_start)
+        return records
+
+    def fetch_item(item_id):
+        response = client.get(f"{url}/api/v3/{endpoint}/{item_id}", params=params)
+        if response.status_code == 404:
+            return item_id, None
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"Failed to get item {item_id}. Status code: {response.status_code}")
+        item = response.json()
+        if endpoint == 'series':
+            with_episodes(url, api_key, item)
+        return item_id, arr_record(item, endpoint)
+
+    records = snapshot['items']
+    changed = {}
+    removed = []
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for item_id, record in executor.map(fetch_item, changed_ids):
+            if record is None:
+                removed.append(item_id)
+                records.pop(item_id, None)
+            elif records.get(item_id) != record:
+                changed[item_id] = record
+    records.update(changed)
+
+    inventory.save(url, endpoint, changed, sync_start, snapshot['full_sync_at'], removed)
+    log.info(f"Refreshed {len(changed)} changed and {len(removed)} removed items from {url} using the cached snapshot")
+    return records
+
 def get_arr_items(url, api_key, endpoint):
     """Get all items from a Radarr or Sonarr instance"""
     log.info(f"Fetching items from {url}")
-    api_url = f"{url}/api/v3/{endpoint}"
-    params = {'apikey': api_key}
-    response = requests.get(api_url, params=params)
-    
-    if response.status_code == 200:
-        items = {}
-        for item in response.json():
-            if endpoint == 'movie' and item['hasFile']:
-                items[item['title']] = Path(item['movieFile']['path'])
-            elif endpoint == 'series':
-                for episode in item.get('episodes', []):
-                    if episode.get('hasFile', False):
-                        items[f"{item['title']} - {episode['seasonNumber']}x{episode['episodeNumber']:02d}"] = Path(episode['episodeFile']['path'])
-        log.info(f"Found {len(items)} items in {url}")
-        return items
-    else:
-        raise requests.exceptions.RequestException(f"Failed to get items. Status code: {response.status_code}")
+    items = []
+    for record in fetch_arr_records(url, api_key, endpoint).values():
+        if endpoint == 'movie' and record['path']:
+            guids = [f"tmdb://{record['tmdbId']}"] if record.get('tmdbId') else []
+            guids += [f"imdb://{record['imdbId']}"] if record.get('imdbId') else []
+            items.append({'title': record['title'], 'year': record.get('year'), 'path': record['path'], 'guids': guids})
+        elif endpoint == 'series':
+            for episode in record['episodes']:
+                items.append({
+                    'title': f"{record['title']} - {episode['seasonNumber']}x{episode['episodeNumber']:02d}",
+                    'year': None,
+                    'path': episode['path'],
+                    'guids': [f"tvdb://{episode['tvdbId']}"] if episode.get('tvdbId') else []
+                })
+    log.info(f"Found {len(items)} items in {url}")
+    return items
 
 def compare_and_mark_for_deletion(plex_duplicates, arr_items):
     """Compare duplicates and mark files for deletion"""
     files_to_delete = []
     
     log.info("Comparing Plex duplicates with Radarr/Sonarr items...")
-    for item in tqdm(plex_duplicates, desc="Comparing", unit="item"):
-        media_info = get_media_info(item)
-        if media_info['title'] in arr_items:
-            arr_file = arr_items[media_info['title']]
+    match_index = matcher.build_index(arr_items)
+    matched_by = Counter()
+    for media_info in tqdm(plex_duplicates, desc="Comparing", unit="item"):
+        record, match_key = matcher.match(media_info, match_index)
+        if record:
+            matched_by[match_key.split('://')[0]] += 1
+            media_info['matched_by'] = match_key
+            arr_file = Path(record['path'])
             plex_files = [Path(file) for file in media_info['file']]
-            if any(plex_file.resolve() != arr_file.resolve() for plex_file in plex_files):
+            if any(not same_file(plex_file, arr_file) for plex_file in plex_files):
                 files_to_delete.append((media_info['title'], plex_files, arr_file, media_info))
-    
+
+    log.info(f"Matched {sum(matched_by.values())} Plex items by key type: {dict(matched_by)}")
     log.info(f"Marked {len(files_to_delete)} items with potential duplicates")
+    files_to_delete = verify_duplicates(files_to_delete, same_file, hash_index)
     return files_to_delete
 
 def confirm_deletion(files_to_delete, dry_run):
-    """Confirm deletion with user"""
+    """Confirm deletion with user, or with the keep/discard policy in unattended runs"""
+    if USE_POLICY:
+        files_to_delete = POLICY.apply(files_to_delete, same_file)
     log.info("Files marked for deletion:")
     for i, (title, plex_files, arr_file, _) in enumerate(files_to_delete, 1):
         log.info(f"\nItem: {title}")
@@ -162,13 +426,15 @@ def confirm_deletion(files_to_delete, dry_run):
         log.info(f"File: {arr_file}")
         log.info("File(s) to be deleted:")
         for plex_file in plex_files:
-            if plex_file != arr_file:
+            if not same_file(plex_file, arr_file):
                 log.info(f"{plex_file}")
         log.info("-" * 80)
     
     if dry_run:
         log.info("DRY RUN: No files will be processed.")
         return files_to_delete
+    if USE_POLICY:
+        return files_to_delete
     
     while True:
         choice = input("\nEnter 'all' to process all files, or file numbers separated by commas to process specific files (or 'q' to quit): ").strip().lower()
@@ -190,92 +456,121 @@ def confirm_deletion(files_to_delete, dry_run):
 
 def process_files(files_to_delete, permanent_delete=False):
     """Process files based on user choice"""
-    successfully_processed = []
-    failed_processes = []
-
     action = "Deleting" if permanent_delete else "Moving"
     log.info(f"{action} files...")
-    for title, plex_files, arr_file, _ in tqdm(files_to_delete, desc=action, unit="item"):
+    disposals = []
+    for title, plex_files, arr_file, media_info in files_to_delete:
         for file in plex_files:
-            if file != arr_file:
-                try:
-                    abs_path = os.path.abspath(file)
-                    log.debug(f"Attempting to {action.lower()}: {abs_path}")
-                    if os.path.exists(abs_path):
-                        if permanent_delete:
-                            os.remove(abs_path)
-                            successfully_processed.append((abs_path, "Deleted"))
-                            log.info(f"Successfully deleted: {abs_path}")
-                        else:
-                            dest = os.path.join(TRASH_DIR, f"{title}_{os.path.basename(file)}")
-                            shutil.move(abs_path, dest)
-                            successfully_processed.append((abs_path, dest))
-                            log.info(f"Successfully moved: {abs_path} to {dest}")
-                    else:
-                        log.warning(f"File not found: {abs_path}")
-                        failed_processes.append(abs_path)
-                except Exception as e:
-                    failed_processes.append(abs_path)
-                    log.error(f"Failed to {action.lower()} {abs_path}: {str(e)}")
-
-    return successfully_processed, failed_processes
+            if not same_file(file, arr_file):
+                # A copy that could not be checked may be a hardlink of the managed file
+                if (USE_POLICY or permanent_delete) and is_unverified(media_info, file):
+                    log.warning(f"Keeping {file}: it could not be verified against {arr_file}")
+                    continue
+                abs_path = os.path.abspath(file)
+                log.debug(f"Attempting to {action.lower()}: {abs_path}")
+                disposals.append((abs_path, f"{title}_{os.path.basename(file)}"))
+
+    return dispose_files(disposals, TRASH_DIR, permanent_delete, workers=DISPOSAL_WORKERS,
+                         per_mount_trash=PER_MOUNT_TRASH, restore_index=RESTORE_INDEX)
 
 def generate_dry_run_report(files_to_delete, instance_name):
-    """Generate a detailed report for dry run"""
+    """Stream a structured dry run report with one row per duplicate group"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"dry_run_report_{instance_name}_{timestamp}.txt"
-    
-    with open(filename, 'w') as f:
-        f.write(f"Dry Run Report - Files that would be processed (Instance: {instance_name})\n")
-        f.write("==============================================\n\n")
-        for title, plex_files, arr_file, media_info in files_to_delete:
-            f.write(f"Item: {title}\n")
-            f.write("Plex Paths:\n")
-            for i, plex_file in enumerate(plex_files, 1):
-                f.write(f"File {i}: {plex_file}\n")
-            f.write("Radarr/Sonarr Path:\n")
-            f.write(f"File: {arr_file}\n")
-            f.write("File(s) to be deleted:\n")
-            for plex_file in plex_files:
-                if plex_file != arr_file:
-                    f.write(f"{plex_file}\n")
-            f.write(f"\nResolution: {media_info['video_resolution']}\n")
-            f.write(f"Video Codec: {media_info['video_codec']}\n")
-            f.write(f"Audio Codec: {media_info['audio_codec']}\n")
-            f.write(f"File Size: {media_info['file_size']} bytes\n")
-            f.write("\n" + "-" * 80 + "\n\n")
-        
-        f.write(f"\nTotal items with duplicates: {len(files_to_delete)}\n")
-    
+    filename = f"dry_run_report_{instance_name}_{timestamp}.{REPORT_FORMAT}"
+
+    with ReportWriter(filename, REPORT_FORMAT) as report:
+        report.write_groups(instance_name, files_to_delete, same_file)
+
     log.info(f"Dry run report generated: {filename}")
     return filename
 
+def timed(func, *args):
+    """Run a function and return its result along with the elapsed seconds"""
+    start = time.monotonic()
+    result = func(*args)
+    return result, time.monotonic() - start
+
+def scan_instances(instances):
+    """Fetch Plex duplicates and *arr items for every instance concurrently"""
+    log.info(f"Scanning {len(instances)} instances with up to {SCAN_WORKERS} workers...")
+    scan_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        # Instances pointing at the same Plex library share one duplicate search
+        plex_futures = {}
+        arr_futures = {}
+        for instance_type, instance_name, instance_config in instances:
+            plex_library = instance_config['plex_library']
+            if plex_library not in plex_futures:
+                plex_futures[plex_library] = executor.submit(timed, get_plex_duplicates, plex_library)
+            endpoint = 'movie' if instance_type == "Radarr" else 'series'
+            arr_futures[(instance_type, instance_name)] = executor.submit(
+                timed, get_arr_items, instance_config['url'], instance_config['api_key'], endpoint)
+
+        results = []
+        for instance_type, instance_name, instance_config in instances:
+            result = {
+                'type': instance_type,
+                'name': instance_name,
+                'library': instance_config['plex_library'],
+                'plex_duplicates': None,
+                'arr_items': None,
+                'timings': {},
+                'error': None
+            }
+            try:
+                result['plex_duplicates'], result['timings']['plex'] = plex_futures[instance_config['plex_library']].result()
+                result['arr_items'], result['timings']['arr'] = arr_futures[(instance_type, instance_name)].result()
+            except Exception as e:
+                result['error'] = str(e)
+            results.append(result)
+
+    log.info(f"Scan phase completed in {time.monotonic() - scan_start:.1f}s")
+    for result in results:
+        if result['error']:
+            log.error(f"{result['type']} instance {result['name']} failed to scan: {result['error']}")
+        else:
+            timings = ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in result['timings'].items())
+            log.info(f"{result['type']} instance {result['name']}: {timings}")
+    return results
+
 def main(dry_run):
     log.info("Starting duplicate file management process")
     
+    instances = [
+        (instance_type, instance_name, instance_config)
+        for instance_type, configured in [("Radarr", radarr_instances), ("Sonarr", sonarr_instances)]
+        for instance_name, instance_config in configured.items()
+    ]
+    scan_results = scan_instances(instances)
+    reclaimable = ReclaimableSpace()
+
     try:
-        for instance_type, instances in [("Radarr", radarr_instances), ("Sonarr", sonarr_instances)]:
-            for instance_name, instance_config in instances.items():
-                log.info(f"Processing {instance_type} instance: {instance_name}")
-                arr_url = instance_config['url']
-                arr_api_key = instance_config['api_key']
-                plex_library = instance_config['plex_library']
-
-                plex_duplicates = get_plex_duplicates(plex_library)
-                arr_items = get_arr_items(arr_url, arr_api_key, 'movie' if instance_type == "Radarr" else 'series')
-                
-                files_to_delete = compare_and_mark_for_deletion(plex_duplicates, arr_items)
-                
-                if not files_to_delete:
-                    log.info(f"No duplicate files to process for {instance_type} instance: {instance_name}")
-                    continue
+        for result in scan_results:
+            instance_type = result['type']
+            instance_name = result['name']
+            if result['error']:
+                continue
+
+            log.info(f"Processing {instance_type} instance: {instance_name}")
+            files_to_delete = compare_and_mark_for_deletion(result['plex_duplicates'], result['arr_items'])
+
+            if args.analytics:
+                reclaimable.add_groups(f"{instance_type}:{instance_name}", result['library'], files_to_delete, same_file)
+                continue
+
+            if not files_to_delete:
+                log.info(f"No duplicate files to process for {instance_type} instance: {instance_name}")
+                continue
+
+            confirmed_files = confirm_deletion(files_to_delete, dry_run)
 
-                confirmed_files = confirm_deletion(files_to_delete, dry_run)
-                
-                if dry_run:
-                    report_file = generate_dry_run_report(confirmed_files, f"{instance_type}_{instance_name}")
-                    log.info(f"DRY RUN: No files were actually processed. Check {report_file} for details.")
-                elif confirmed_files:
+            if dry_run:
+                report_file = generate_dry_run_report(confirmed_files, f"{instance_type}_{instance_name}")
+                log.info(f"DRY RUN: No files were actually processed. Check {report_file} for details.")
+            elif confirmed_files:
+                if USE_POLICY:
+                    action_choice = POLICY.action
+                else:
                     while True:
                         action_choice = input("\nDo you want to permanently delete the files or move them to trash? (delete/trash): ").strip().lower()
                         if action_choice in ['delete', 'trash']:
@@ -283,27 +578,34 @@ def main(dry_run):
                         else:
                             print("Invalid choice. Please enter 'delete' or 'trash'.")
 
-                    permanent_delete = action_choice == 'delete'
-                    successfully_processed, failed_processes = process_files(confirmed_files, permanent_delete)
-                    
-                    action = "deleted" if permanent_delete else "moved to trash"
-                    log.info(f"Successfully {action} {len(successfully_processed)} files")
-                    if failed_processes:
-                        log.warning(f"Failed to process {len(failed_processes)} files")
-                    
-                    if not permanent_delete:
-                        log.info("Files that still exist in their original location:")
-                        for _, plex_files, arr_file, _ in confirmed_files:
-                            for file in plex_files:
-                                if file != arr_file and file.exists():
-                                    log.info(str(file))
-                else:
-                    log.info(f"No files confirmed for processing for {instance_type} instance: {instance_name}")
-    
+                permanent_delete = action_choice == 'delete'
+                successfully_processed, failed_processes = process_files(confirmed_files, permanent_delete)
+
+                action = "deleted" if permanent_delete else "moved to trash"
+                log.info(f"Successfully {action} {len(successfully_processed)} files")
+                if failed_processes:
+                    log.warning(f"Failed to process {len(failed_processes)} files")
+
+                if not permanent_delete:
+                    log.info("Files that still exist in their original location:")
+                    for _, plex_files, arr_file, _ in confirmed_files:
+                        for file in plex_files:
+                            if not same_file(file, arr_file) and file.exists():
+                                log.info(str(file))
+            else:
+                log.info(f"No files confirmed for processing for {instance_type} instance: {instance_name}")
+
     except Exception as e:
         log.error(f"An error occurred during the process: {str(e)}")
-    
+
+    if args.analytics:
+        reclaimable.log_summary()
+    log.info(f"HTTP client: {client.stats.summary()}")
     log.info("Duplicate file management process completed")
 
 if __name__ == "__main__":
-    main(args.dry_run)
\ No newline at end of file
+    if args.restore:
+        restored, failed = restore_files(RESTORE_INDEX)
+        log.info(f"Restored {len(restored)} files, {len(failed)} failed")
+    else:
+        main(args.dry_run)
\ No newline at end of file
@@ -4,15 +4,29 @@ import logging
 import time
 import argparse
 import configparser
-import shutil
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
+from xml.etree import ElementTree
 
 from plexapi.server import PlexServer
+import ijson
 import requests
 from tqdm import tqdm
 from colorama import init, Fore, Style
 
+# The shared HTTP client lives in Common/ at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'Common'))
+from analytics import ReclaimableSpace
+from arr_client import ArrClient
+from disposal import dispose_files, restore_files
+from inventory import InventoryCache, MediaInfo
+from matching import FileMatcher
+from policy import DuplicatePolicy
+from report import ReportWriter
+from verification import HashIndex, is_unverified, verify_duplicates
+
 # Initialize colorama
 init(autoreset=True)
 
@@ -38,7 +52,13 @@ def load_config(config_file):
 # Set up argument parser
 parser = argparse.ArgumentParser(description="Manage duplicate movie files between Plex and multiple Radarr instances")
 parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without processing any files")
+parser.add_argument("--policy", action="store_true", help="Decide with the [Policy] rules instead of prompting, for unattended runs")
+parser.add_argument("--analytics", action="store_true", help="Report the reclaimable space per instance, library, resolution and codec without processing any files")
+parser.add_argument("--restore", action="store_true", help="Move every file in the restore index back out of the trash and exit")
 parser.add_argument("--config", "-c", default="config.ini", help="Specify the configuration file (default: config.ini)")
+parser.add_argument("--verify-paths", action="store_true", help="Resolve symlinks on the filesystem when comparing Plex and Radarr paths")
+parser.add_argument("--refresh-cache", action="store_true", help="Ignore the inventory cache and fetch every library in full")
+parser.add_argument("--cache-ttl", type=int, help="Seconds before a cached snapshot needs a full refresh (default: Cache.TTL or 86400)")
 args = parser.parse_args()
 
 # Load configuration
@@ -52,6 +72,8 @@ log = logging.getLogger("Plex_Radarr_DupeManager")
 # Plex configuration
 PLEX_URL = config.get('Plex', 'URL')
 PLEX_TOKEN = config.get('Plex', 'Token')
+PLEX_PAGE_SIZE = config.getint('Plex', 'PageSize', fallback=1000)
+PLEX_LEAN_FETCH = config.getboolean('Plex', 'LeanFetch', fallback=True)
 
 # Radarr instances configuration
 radarr_instances = {}
@@ -65,6 +87,44 @@ for section in config.sections():
         }
 
 TRASH_DIR = Path(config.get('General', 'TrashDirectory', fallback='./trash'))
+FETCH_WORKERS = config.getint('General', 'FetchWorkers', fallback=8)
+DISPOSAL_WORKERS = config.getint('General', 'DisposalWorkers', fallback=4)
+PER_MOUNT_TRASH = config.getboolean('General', 'PerMountTrash', fallback=True)
+RESTORE_INDEX = config.get('General', 'RestoreIndex', fallback='phasarr_restore.jsonl')
+
+# Hardlinks of the managed file are always kept; same-size copies are partially hashed
+hash_index = HashIndex(
+    config.get('General', 'HashIndex', fallback='phasarr_hashes.db'),
+    workers=config.getint('General', 'HashWorkers', fallback=4)
+) if config.getboolean('General', 'HashContent', fallback=True) else None
+
+# Dry run reports are written as jsonl or csv
+REPORT_FORMAT = config.get('General', 'ReportFormat', fallback='jsonl').strip().lower()
+
+# Keep/discard policy for unattended runs
+USE_POLICY = args.policy or config.getboolean('Policy', 'Enabled', fallback=False)
+POLICY = DuplicatePolicy.from_config(config) if config.has_section('Policy') else DuplicatePolicy()
+
+# Plex to Radarr path prefix mappings and symlink resolution used to match files
+matcher = FileMatcher.from_config(config, verify_paths=args.verify_paths)
+same_file = matcher.same_file
+
+# Shared HTTP client for all Plex and *arr requests
+client = ArrClient(
+    timeout=config.getint('HTTP', 'Timeout', fallback=30),
+    retries=config.getint('HTTP', 'Retries', fallback=3),
+    rate_limit=config.getfloat('HTTP', 'RateLimit', fallback=0) or None,
+    pool_size=max(FETCH_WORKERS, 10)
+)
+
+# Inventory cache configuration
+inventory = InventoryCache(
+    config.get('Cache', 'Path', fallback='phasarr_cache.db'),
+    ttl=args.cache_ttl if args.cache_ttl is not None else config.getint('Cache', 'TTL', fallback=86400),
+    refresh=args.refresh_cache
+)
+# Changed items refetched one by one before a snapshot is refreshed with a full fetch instead
+REFRESH_LIMIT = config.getint('Cache', 'RefreshLimit', fallback=500)
 
 # Create trash directory if it doesn't exist
 TRASH_DIR.mkdir(parents=True, exist_ok=True)
@@ -77,69 +137,229 @@ except Exception as e:
     print(f"Exception connecting to {PLEX_URL}: {str(e)}")
     sys.exit(1)
 
+def parse_plex_item(elem):
+    """Build a media info record from a streamed Plex Video element"""
+    info = MediaInfo(
+        id=int(elem.get('ratingKey')),
+        title=elem.get('title'),
+        year=int(elem.get('year')) if elem.get('year') else None,
+        guids=[guid.get('id') for guid in elem.iter('Guid')],
+        updated=elem.get('updatedAt', '')
+    )
+    for media in elem.iter('Media'):
+        info.video_resolution = media.get('videoResolution') or 'Unknown'
+        info.video_codec = media.get('videoCodec') or 'Unknown'
+        info.audio_codec = media.get('audioCodec') or 'Unknown'
+        for part in media.iter('Part'):
+            size = int(part.get('size') or 0)
+            info.file.append(part.get('file'))
+            info.file_size += size
+            info.parts.append([part.get('file'), size, info.video_resolution, info.video_codec, info.audio_codec])
+    return info
+
+def iter_plex_duplicates(section_key, since=None):
+    """Stream duplicate items from a Plex library one container window at a time"""
+    params = {'duplicate': 1, 'includeGuids': 1}
+    if since:
+        params['updatedAt>>'] = int(since)
+    headers = {'X-Plex-Token': PLEX_TOKEN, 'Accept': 'application/xml'}
+    start = 0
+    while True:
+        headers['X-Plex-Container-Start'] = str(start)
+        headers['X-Plex-Container-Size'] = str(PLEX_PAGE_SIZE)
+        response = client.get(f"{PLEX_URL}/library/sections/{section_key}/all", params=params, headers=headers, stream=True, timeout=60)
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        total_size = 0
+        count = 0
+        # Only the Video elements are kept, and each one is cleared as soon as it has been read
+        for event, elem in ElementTree.iterparse(response.raw, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == 'MediaContainer':
+                    total_size = int(elem.get('totalSize', elem.get('size', 0)))
+            elif elem.tag == 'Video':
+                count += 1
+                yield parse_plex_item(elem)
+                elem.clear()
+
+        start += count
+        if count == 0 or start >= total_size:
+            break
+
+def fetch_plex_duplicates(section, since=None):
+    """Fetch duplicate items from a Plex library section as media info records"""
+    fetch_start = time.monotonic()
+    if PLEX_LEAN_FETCH:
+        duplicates = list(iter_plex_duplicates(section.key, since))
+    else:
+        filters = {'updatedAt>>': datetime.fromtimestamp(since)} if since else None
+        duplicates = [get_media_info(item) for item in section.search(duplicate=True, filters=filters, includeGuids=True)]
+    fetch_time = time.monotonic() - fetch_start
+    if duplicates:
+        log.info(f"Fetched {len(duplicates)} Plex items from {section.title} in {fetch_time:.1f}s ({fetch_time / len(duplicates) * 10000:.1f}s per 10k items)")
+    return duplicates
+
 def get_plex_duplicates(library_section):
     """Get duplicate movies from Plex"""
     log.info(f"Connecting to Plex server and scanning {library_section} library...")
     section = plex.library.section(library_section)
-    duplicates = section.search(duplicate=True)
+    snapshot = inventory.load(PLEX_URL, library_section)
+    sync_start = time.time()
+
+    if snapshot is not None:
+        duplicates = {key: MediaInfo(**row) for key, row in snapshot['items'].items()}
+        changed = {str(info['id']): info for info in fetch_plex_duplicates(section, snapshot['synced_at'])}
+        duplicates.update(changed)
+        # Items that stopped being duplicates are not returned by the updatedAt search,
+        # so only trust the merged snapshot when its size matches what Plex reports
+        container = plex.query(
+            f"/library/sections/{section.key}/all?duplicate=1",
+            headers={'X-Plex-Container-Start': '0', 'X-Plex-Container-Size': '0'}
+        )
+        if int(container.attrib.get('totalSize', -1)) == len(duplicates):
+            inventory.save(PLEX_URL, library_section, changed, sync_start, snapshot['full_sync_at'])
+            log.info(f"Found {len(duplicates)} movies with duplicates in Plex library: {library_section} ({len(changed)} refreshed from Plex)")
+            return list(duplicates.values())
+        log.info(f"Cached duplicates for {library_section} are out of date, rescanning the whole library...")
+
+    duplicates = {str(info['id']): info for info in fetch_plex_duplicates(section)}
+    inventory.save(PLEX_URL, library_section, duplicates, sync_start, sync_start)
     log.info(f"Found {len(duplicates)} movies with duplicates in Plex library: {library_section}")
-    return duplicates
+    return list(duplicates.values())
+
+def plex_guids(item):
+    """GUIDs of a Plex item, read from the fetched XML so plexapi does not reload the item"""
+    return [guid.attrib['id'] for guid in item._data.findall('Guid')]
+
+def plex_year(item):
+    """Year of a Plex item, read from the fetched XML so plexapi does not reload the item"""
+    year = item._data.attrib.get('year')
+    return int(year) if year else None
 
 def get_media_info(item):
     """Get media info for a Plex item"""
-    info = {
-        'id': item.ratingKey,
-        'title': item.title,
-        'file': [],
-        'video_resolution': 'Unknown',
-        'video_codec': 'Unknown',
-        'audio_codec': 'Unknown',
-        'file_size': 0
-    }
+    info = MediaInfo(
+        id=item.ratingKey,
+        title=item.title,
+        guids=plex_guids(item),
+        year=plex_year(item),
+        updated=str(item.updatedAt)
+    )
     for media in item.media:
-        for part in media.parts:
-            info['file'].append(part.file)
-            info['file_size'] += part.size if part.size else 0
         info['video_resolution'] = media.videoResolution if media.videoResolution else 'Unknown'
         info['video_codec'] = media.videoCodec if media.videoCodec else 'Unknown'
         info['audio_codec'] = media.audioCodec if media.audioCodec else 'Unknown'
+        for part in media.parts:
+            info['file'].append(part.file)
+            info['file_size'] += part.size if part.size else 0
+            info['parts'].append([part.file, part.size or 0, info['video_resolution'], info['video_codec'], info['audio_codec']])
     return info
 
+def radarr_record(movie):
+    """Reduce a Radarr movie to the fields used for matching"""
+    movie_file = movie['movieFile'] if movie['hasFile'] else {}
+    return {
+        'id': movie['id'],
+        'title': movie['title'],
+        'year': movie.get('year'),
+        'tmdbId': movie.get('tmdbId'),
+        'imdbId': movie.get('imdbId'),
+        'path': movie_file.get('path'),
+        'updated': max(movie.get('lastInfoSync') or '', movie.get('added') or '', movie_file.get('dateAdded') or '')
+    }
+
+def fetch_radarr_records(url, api_key):
+    """Fetch Radarr movies, only refreshing changed ones when a cached snapshot is available"""
+    params = {'apikey': api_key}
+    snapshot = inventory.load(url, 'movie')
+    sync_start = time.time()
+
+    if snapshot is not None:
+        # Every file import, upgrade or deletion leaves a history event, so the history
+        # since the last sync tells us which movies need to be fetched again
+        since = datetime.fromtimestamp(snapshot['synced_at'], timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        response = client.get(f"{url}/api/v3/history/since", params={**params, 'date': since})
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"Failed to get history from Radarr. Status code: {response.status_code}")
+        changed_ids = {str(event['movieId']) for event in response.json() if event.get('movieId')}
+        # Past the cutoff one streamed fetch of the whole list is cheaper than a request per movie
+        if len(changed_ids) > REFRESH_LIMIT:
+            log.info(f"{len(changed_ids)} movies changed in {url} since the last sync, fetching the full list")
+            snapshot = None
+
+    if snapshot is None:
+        response = client.get(f"{url}/api/v3/movie", params=params, stream=True)
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"Failed to get movies from Radarr. Status code: {response.status_code}")
+        # Parse the list one movie at a time so only the trimmed records stay in memory
+        response.raw.decode_content = True
+        records = {str(movie['id']): radarr_record(movie) for movie in ijson.items(response.raw, 'item', use_float=True)}
+        inventory.save(url, 'movie', records, sync_start, sync_start)
+        return records
+
+    def fetch_movie(movie_id):
+        response = client.get(f"{url}/api/v3/movie/{movie_id}", params=params)
+        if response.status_code == 404:
+            return movie_id, None
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"Failed to get movie {movie_id} from Radarr. Status code: {response.status_code}")
+        return movie_id, radarr_record(response.json())
+
+    records = snapshot['items']
+    changed = {}
+    removed = []
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for movie_id, record in executor.map(fetch_movie, changed_ids):
+            if record is None:
+                removed.append(movie_id)
+                records.pop(movie_id, None)
+            elif records.get(movie_id) != record:
+                changed[movie_id] = record
+    records.update(changed)
+
+    inventory.save(url, 'movie', changed, sync_start, snapshot['full_sync_at'], removed)
+    log.info(f"Refreshed {len(changed)} changed and {len(removed)} removed movies from {url} using the cached snapshot")
+    return records
+
 def get_radarr_movies(url, api_key):
     """Get all movies from a Radarr instance"""
     log.info(f"Fetching movies from Radarr instance: {url}")
-    api_url = f"{url}/api/v3/movie"
-    params = {'apikey': api_key}
-    response = requests.get(api_url, params=params)
-    
-    if response.status_code == 200:
-        movies = {}
-        for movie in response.json():
-            if movie['hasFile']:
-                movies[movie['title']] = Path(movie['movieFile']['path'])
-        log.info(f"Found {len(movies)} movies in Radarr instance: {url}")
-        return movies
-    else:
-        raise requests.exceptions.RequestException(f"Failed to get movies from Radarr. Status code: {response.status_code}")
+    movies = []
+    for record in fetch_radarr_records(url, api_key).values():
+        if record['path']:
+            guids = [f"tmdb://{record['tmdbId']}"] if record.get('tmdbId') else []
+            guids += [f"imdb://{record['imdbId']}"] if record.get('imdbId') else []
+            movies.append({'title': record['title'], 'year': record.get('year'), 'path': record['path'], 'guids': guids})
+    log.info(f"Found {len(movies)} movies in Radarr instance: {url}")
+    return movies
 
 def compare_and_mark_for_deletion(plex_duplicates, radarr_movies):
     """Compare duplicates and mark files for deletion"""
     files_to_delete = []
     
     log.info("Comparing Plex duplicates with Radarr movies...")
-    for item in tqdm(plex_duplicates, desc="Comparing", unit="movie"):
-        media_info = get_media_info(item)
-        if media_info['title'] in radarr_movies:
-            radarr_file = radarr_movies[media_info['title']]
+    match_index = matcher.build_index(radarr_movies)
+    matched_by = Counter()
+    for media_info in tqdm(plex_duplicates, desc="Comparing", unit="movie"):
+        record, match_key = matcher.match(media_info, match_index)
+        if record:
+            matched_by[match_key.split('://')[0]] += 1
+            media_info['matched_by'] = match_key
+            radarr_file = Path(record['path'])
             plex_files = [Path(file) for file in media_info['file']]
-            if any(plex_file.resolve() != radarr_file.resolve() for plex_file in plex_files):
+            if any(not same_file(plex_file, radarr_file) for plex_file in plex_files):
                 files_to_delete.append((media_info['title'], plex_files, radarr_file, media_info))
-    
+
+    log.info(f"Matched {sum(matched_by.values())} Plex items by key type: {dict(matched_by)}")
     log.info(f"Marked {len(files_to_delete)} movies with potential duplicates")
+    files_to_delete = verify_duplicates(files_to_delete, same_file, hash_index)
     return files_to_delete
 
 def confirm_deletion(files_to_delete, dry_run):
-    """Confirm deletion with user"""
+    """Confirm deletion with user, or with the keep/discard policy in unattended runs"""
+    if USE_POLICY:
+        files_to_delete = POLICY.apply(files_to_delete, same_file)
     log.info("Files marked for deletion:")
     for i, (title, plex_files, radarr_file, _) in enumerate(files_to_delete, 1):
         log.info(f"\nMovie: {title}")
@@ -150,13 +370,15 @@ def confirm_deletion(files_to_delete, dry_run):
         log.info(f"File: {radarr_file}")
         log.info("File(s) to be deleted:")
         for plex_file in plex_files:
-            if plex_file != radarr_file:
+            if not same_file(plex_file, radarr_file):
                 log.info(f"{plex_file}")
         log.info("-" * 80)
     
     if dry_run:
         log.info("DRY RUN: No files will be processed.")
         return files_to_delete
+    if USE_POLICY:
+        return files_to_delete
     
     while True:
         choice = input("\nEnter 'all' to process all files, or file numbers separated by commas to process specific files (or 'q' to quit): ").strip().lower()
@@ -178,68 +400,37 @@ def confirm_deletion(files_to_delete, dry_run):
 
 def process_files(files_to_delete, permanent_delete=False):
     """Process files based on user choice"""
-    successfully_processed = []
-    failed_processes = []
-
     action = "Deleting" if permanent_delete else "Moving"
     log.info(f"{action} files...")
-    for title, plex_files, radarr_file, _ in tqdm(files_to_delete, desc=action, unit="movie"):
+    disposals = []
+    for title, plex_files, radarr_file, media_info in files_to_delete:
         for file in plex_files:
-            if file != radarr_file:
-                try:
-                    abs_path = os.path.abspath(file)
-                    log.debug(f"Attempting to {action.lower()}: {abs_path}")
-                    if os.path.exists(abs_path):
-                        if permanent_delete:
-                            os.remove(abs_path)
-                            successfully_processed.append((abs_path, "Deleted"))
-                            log.info(f"Successfully deleted: {abs_path}")
-                        else:
-                            dest = os.path.join(TRASH_DIR, f"{title}_{os.path.basename(file)}")
-                            shutil.move(abs_path, dest)
-                            successfully_processed.append((abs_path, dest))
-                            log.info(f"Successfully moved: {abs_path} to {dest}")
-                    else:
-                        log.warning(f"File not found: {abs_path}")
-                        failed_processes.append(abs_path)
-                except Exception as e:
-                    failed_processes.append(abs_path)
-                    log.error(f"Failed to {action.lower()} {abs_path}: {str(e)}")
-
-    return successfully_processed, failed_processes
+            if not same_file(file, radarr_file):
+                # A copy that could not be checked may be a hardlink of the managed file
+                if (USE_POLICY or permanent_delete) and is_unverified(media_info, file):
+                    log.warning(f"Keeping {file}: it could not be verified against {radarr_file}")
+                    continue
+                abs_path = os.path.abspath(file)
+                log.debug(f"Attempting to {action.lower()}: {abs_path}")
+                disposals.append((abs_path, f"{title}_{os.path.basename(file)}"))
+
+    return dispose_files(disposals, TRASH_DIR, permanent_delete, workers=DISPOSAL_WORKERS,
+                         per_mount_trash=PER_MOUNT_TRASH, restore_index=RESTORE_INDEX)
 
 def generate_dry_run_report(files_to_delete, instance_name):
-    """Generate a detailed report for dry run"""
+    """Stream a structured dry run report with one row per duplicate group"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"dry_run_report_{instance_name}_{timestamp}.txt"
-    
-    with open(filename, 'w') as f:
-        f.write(f"Dry Run Report - Files that would be processed (Radarr Instance: {instance_name})\n")
-        f.write("==============================================\n\n")
-        for title, plex_files, radarr_file, media_info in files_to_delete:
-            f.write(f"Movie: {title}\n")
-            f.write("Plex Paths:\n")
-            for i, plex_file in enumerate(plex_files, 1):
-                f.write(f"File {i}: {plex_file}\n")
-            f.write("Radarr Path:\n")
-            f.write(f"File: {radarr_file}\n")
-            f.write("File(s) to be deleted:\n")
-            for plex_file in plex_files:
-                if plex_file != radarr_file:
-                    f.write(f"{plex_file}\n")
-            f.write(f"\nResolution: {media_info['video_resolution']}\n")
-            f.write(f"Video Codec: {media_info['video_codec']}\n")
-            f.write(f"Audio Codec: {media_info['audio_codec']}\n")
-            f.write(f"File Size: {media_info['file_size']} bytes\n")
-            f.write("\n" + "-" * 80 + "\n\n")
-        
-        f.write(f"\nTotal movies with duplicates: {len(files_to_delete)}\n")
-    
+    filename = f"dry_run_report_{instance_name}_{timestamp}.{REPORT_FORMAT}"
+
+    with ReportWriter(filename, REPORT_FORMAT) as report:
+        report.write_groups(instance_name, files_to_delete, same_file)
+
     log.info(f"Dry run report generated: {filename}")
     return filename
 
 def main(dry_run):
     log.info("Starting duplicate file management process")
+    reclaimable = ReclaimableSpace()
     
     try:
         for instance_name, instance_config in radarr_instances.items():
@@ -252,6 +443,10 @@ def main(dry_run):
             radarr_movies = get_radarr_movies(radarr_url, radarr_api_key)
             
             files_to_delete = compare_and_mark_for_deletion(plex_duplicates, radarr_movies)
+
+            if args.analytics:
+                reclaimable.add_groups(instance_name, plex_library, files_to_delete, same_file)
+                continue
             
             if not files_to_delete:
                 log.info(f"No duplicate files to process for Radarr instance: {instance_name}")
@@ -263,12 +458,15 @@ def main(dry_run):
                 report_file = generate_dry_run_report(confirmed_files, instance_name)
                 log.info(f"DRY RUN: No files were actually processed. Check {report_file} for details.")
             elif confirmed_files:
-                while True:
-                    action_choice = input("\nDo you want to permanently delete the files or move them to trash? (delete/trash): ").strip().lower()
-                    if action_choice in ['delete', 'trash']:
-                        break
-                    else:
-                        print("Invalid choice. Please enter 'delete' or 'trash'.")
+                if USE_POLICY:
+                    action_choice = POLICY.action
+                else:
+                    while True:
+                        action_choice = input("\nDo you want to permanently delete the files or move them to trash? (delete/trash): ").strip().lower()
+                        if action_choice in ['delete', 'trash']:
+                            break
+                        else:
+                            print("Invalid choice. Please enter 'delete' or 'trash'.")
 
                 permanent_delete = action_choice == 'delete'
                 successfully_processed, failed_processes = process_files(confirmed_files, permanent_delete)
@@ -282,7 +480,7 @@ def main(dry_run):
                     log.info("Files that still exist in their original location:")
                     for _, plex_files, radarr_file, _ in confirmed_files:
                         for file in plex_files:
-                            if file != radarr_file and file.exists():
+                            if not same_file(file, radarr_file) and file.exists():
                                 log.info(str(file))
             else:
                 log.info(f"No files confirmed for processing for Radarr instance: {instance_name}")
@@ -290,7 +488,14 @@ def main(dry_run):
     except Exception as e:
         log.error(f"An error occurred during the process: {str(e)}")
     
+    if args.analytics:
+        reclaimable.log_summary()
+    log.info(f"HTTP client: {client.stats.summary()}")
     log.info("Duplicate file management process completed")
 
 if __name__ == "__main__":
-    main(args.dry_run)
\ No newline at end of file
+    if args.restore:
+        restored, failed = restore_files(RESTORE_INDEX)
+        log.info(f"Restored {len(restored)} files, {len(failed)} failed")
+    else:
+        main(args.dry_run)
\ No newline at end of file
@@ -4,12 +4,25 @@ import logging
 import time
 import argparse
 import configparser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
 
 from plexapi.server import PlexServer
 import requests
 from tqdm import tqdm
 
+# The shared HTTP client lives in Common/ at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'Common'))
+from analytics import ReclaimableSpace
+from arr_client import ArrClient
+from disposal import dispose_files, restore_files
+from matching import FileMatcher
+from policy import DuplicatePolicy
+from report import ReportWriter
+from verification import HashIndex, is_unverified, verify_duplicates
+
 def setup_logging(log_file):
     """Set up logging configuration"""
     logging.basicConfig(
@@ -32,7 +45,11 @@ def load_config(config_file):
 # Set up argument parser
 parser = argparse.ArgumentParser(description="Manage duplicate files between Plex and Sonarr")
 parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without processing any files")
+parser.add_argument("--policy", action="store_true", help="Decide with the [Policy] rules instead of prompting, for unattended runs")
+parser.add_argument("--analytics", action="store_true", help="Report the reclaimable space per instance, library, resolution and codec without processing any files")
+parser.add_argument("--restore", action="store_true", help="Move every file in the restore index back out of the trash and exit")
 parser.add_argument("--config", "-c", default="config.ini", help="Specify the configuration file (default: config.ini)")
+parser.add_argument("--verify-paths", action="store_true", help="Resolve symlinks on the filesystem when comparing Plex and Sonarr paths")
 args = parser.parse_args()
 
 # Load configuration
@@ -53,6 +70,35 @@ SONARR_API_KEY = config.get('Sonarr', 'APIKey')
 SONARR_PLEX_LIBRARY = config.get('Sonarr', 'PlexLibrary')
 
 TRASH_DIR = Path(config.get('General', 'TrashDirectory', fallback='./trash'))
+FETCH_WORKERS = config.getint('General', 'FetchWorkers', fallback=8)
+DISPOSAL_WORKERS = config.getint('General', 'DisposalWorkers', fallback=4)
+PER_MOUNT_TRASH = config.getboolean('General', 'PerMountTrash', fallback=True)
+RESTORE_INDEX = config.get('General', 'RestoreIndex', fallback='phasarr_restore.jsonl')
+
+# Hardlinks of the managed file are always kept; same-size copies are partially hashed
+hash_index = HashIndex(
+    config.get('General', 'HashIndex', fallback='phasarr_hashes.db'),
+    workers=config.getint('General', 'HashWorkers', fallback=4)
+) if config.getboolean('General', 'HashContent', fallback=True) else None
+
+# Dry run reports are written as jsonl or csv
+REPORT_FORMAT = config.get('General', 'ReportFormat', fallback='jsonl').strip().lower()
+
+# Keep/discard policy for unattended runs
+USE_POLICY = args.policy or config.getboolean('Policy', 'Enabled', fallback=False)
+POLICY = DuplicatePolicy.from_config(config) if config.has_section('Policy') else DuplicatePolicy()
+
+# Plex to Sonarr path prefix mappings and symlink resolution used to match files
+matcher = FileMatcher.from_config(config, verify_paths=args.verify_paths)
+same_file = matcher.same_file
+
+# Shared HTTP client for all Plex and *arr requests
+client = ArrClient(
+    timeout=config.getint('HTTP', 'Timeout', fallback=30),
+    retries=config.getint('HTTP', 'Retries', fallback=3),
+    rate_limit=config.getfloat('HTTP', 'RateLimit', fallback=0) or None,
+    pool_size=FETCH_WORKERS
+)
 
 # Create trash directory if it doesn't exist
 TRASH_DIR.mkdir(parents=True, exist_ok=True)
@@ -69,10 +115,19 @@ def get_plex_duplicates(library_section):
     """Get duplicate items from Plex"""
     log.info(f"Connecting to Plex server and scanning {library_section} library...")
     section = plex.library.section(library_section)
-    duplicates = section.search(duplicate=True)
+    duplicates = section.search(libtype='episode', duplicate=True, includeGuids=True)
     log.info(f"Found {len(duplicates)} items with duplicates in Plex library: {library_section}")
     return duplicates
 
+def plex_guids(item):
+    """GUIDs of a Plex item, read from the fetched XML so plexapi does not reload the item"""
+    return [guid.attrib['id'] for guid in item._data.findall('Guid')]
+
+def plex_year(item):
+    """Year of a Plex item, read from the fetched XML so plexapi does not reload the item"""
+    year = item._data.attrib.get('year')
+    return int(year) if year else None
+
 def get_media_info(item):
     """Get media info for a Plex item"""
     info = {
@@ -82,34 +137,69 @@ def get_media_info(item):
         'video_resolution': 'Unknown',
         'video_codec': 'Unknown',
         'audio_codec': 'Unknown',
-        'file_size': 0
+        'file_size': 0,
+        'parts': [],
+        'guids': plex_guids(item),
+        'year': plex_year(item)
     }
     for media in item.media:
-        for part in media.parts:
-            info['file'].append(part.file)
-            info['file_size'] += part.size if part.size else 0
         info['video_resolution'] = media.videoResolution if media.videoResolution else 'Unknown'
         info['video_codec'] = media.videoCodec if media.videoCodec else 'Unknown'
         info['audio_codec'] = media.audioCodec if media.audioCodec else 'Unknown'
+        for part in media.parts:
+            info['file'].append(part.file)
+            info['file_size'] += part.size if part.size else 0
+            info['parts'].append([part.file, part.size or 0, info['video_resolution'], info['video_codec'], info['audio_codec']])
     return info
 
+def fetch_series_episodes(series):
+    """Fetch the episodes with files for a single series"""
+    episodes_url = f"{SONARR_URL}/api/v3/episode"
+    episodes_params = {'apikey': SONARR_API_KEY, 'seriesId': series['id'], 'includeEpisodeFile': 'true'}
+    episodes_response = client.get(episodes_url, params=episodes_params)
+    episodes_response.raise_for_status()
+    return [episode for episode in episodes_response.json() if episode.get('hasFile', False)]
+
 def get_sonarr_items():
     """Get all items from Sonarr"""
     log.info(f"Fetching items from Sonarr")
     api_url = f"{SONARR_URL}/api/v3/series"
     params = {'apikey': SONARR_API_KEY}
-    response = requests.get(api_url, params=params)
+    fetch_start = time.monotonic()
+    response = client.get(api_url, params=params)
     
     if response.status_code == 200:
-        items = {}
-        for series in response.json():
-            episodes_url = f"{SONARR_URL}/api/v3/episode"
-            episodes_params = {'apikey': SONARR_API_KEY, 'seriesId': series['id']}
-            episodes_response = requests.get(episodes_url, params=episodes_params)
-            if episodes_response.status_code == 200:
-                for episode in episodes_response.json():
-                    if episode.get('hasFile', False):
-                        items[f"{series['title']} - {episode['seasonNumber']}x{episode['episodeNumber']:02d}"] = Path(episode['episodeFile']['path'])
+        all_series = response.json()
+        # Sonarr has no bulk endpoint that returns episode numbers together with file paths,
+        # so skip series without files and pipeline the rest through the pooled client
+        series_with_files = [
+            series for series in all_series
+            if series.get('statistics', {}).get('episodeFileCount', 1) > 0
+        ]
+        log.info(f"Fetching episodes for {len(series_with_files)} of {len(all_series)} series using {FETCH_WORKERS} workers")
+
+        items = []
+        request_count = 1
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            futures = {executor.submit(fetch_series_episodes, series): series for series in series_with_files}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Fetching episodes", unit="series"):
+                series = futures[future]
+                request_count += 1
+                try:
+                    episodes = future.result()
+                except requests.exceptions.RequestException as e:
+                    log.warning(f"Failed to get episodes for {series['title']}: {str(e)}")
+                    continue
+                for episode in episodes:
+                    items.append({
+                        'title': f"{series['title']} - {episode['seasonNumber']}x{episode['episodeNumber']:02d}",
+                        'year': None,
+                        'path': episode['episodeFile']['path'],
+                        'guids': [f"tvdb://{episode['tvdbId']}"] if episode.get('tvdbId') else []
+                    })
+
+        fetch_time = time.monotonic() - fetch_start
+        log.info(f"Made {request_count} Sonarr requests in {fetch_time:.1f}s ({request_count / fetch_time:.1f} requests/sec)")
         log.info(f"Found {len(items)} episodes in Sonarr")
         return items
     else:
@@ -120,19 +210,28 @@ def compare_and_mark_for_deletion(plex_duplicates, sonarr_items):
     files_to_delete = []
     
     log.info("Comparing Plex duplicates with Sonarr items...")
+    match_index = matcher.build_index(sonarr_items)
+    matched_by = Counter()
     for item in tqdm(plex_duplicates, desc="Comparing", unit="item"):
         media_info = get_media_info(item)
-        if media_info['title'] in sonarr_items:
-            sonarr_file = sonarr_items[media_info['title']]
+        record, match_key = matcher.match(media_info, match_index)
+        if record:
+            matched_by[match_key.split('://')[0]] += 1
+            media_info['matched_by'] = match_key
+            sonarr_file = Path(record['path'])
             plex_files = [Path(file) for file in media_info['file']]
-            if any(plex_file.resolve() != sonarr_file.resolve() for plex_file in plex_files):
+            if any(not same_file(plex_file, sonarr_file) for plex_file in plex_files):
                 files_to_delete.append((media_info['title'], plex_files, sonarr_file, media_info))
-    
+
+    log.info(f"Matched {sum(matched_by.values())} Plex items by key type: {dict(matched_by)}")
     log.info(f"Marked {len(files_to_delete)} items with potential duplicates")
+    files_to_delete = verify_duplicates(files_to_delete, same_file, hash_index)
     return files_to_delete
 
 def confirm_deletion(files_to_delete, dry_run):
-    """Confirm deletion with user"""
+    """Confirm deletion with user, or with the keep/discard policy in unattended runs"""
+    if USE_POLICY:
+        files_to_delete = POLICY.apply(files_to_delete, same_file)
     log.info("Files marked for deletion:")
     for i, (title, plex_files, sonarr_file, _) in enumerate(files_to_delete, 1):
         log.info(f"\n{i}. Item: {title}")
@@ -143,13 +242,15 @@ def confirm_deletion(files_to_delete, dry_run):
         log.info(f"  File: {sonarr_file}")
         log.info("File(s) to be deleted:")
         for plex_file in plex_files:
-            if plex_file != sonarr_file:
+            if not same_file(plex_file, sonarr_file):
                 log.info(f"  {plex_file}")
         log.info("-" * 80)
     
     if dry_run:
         log.info("DRY RUN: No files will be processed.")
         return files_to_delete
+    if USE_POLICY:
+        return files_to_delete
     
     while True:
         choice = input("\nEnter 'all' to process all files, or file numbers separated by commas to process specific files (or 'q' to quit): ").strip().lower()
@@ -171,35 +272,33 @@ def confirm_deletion(files_to_delete, dry_run):
 
 def process_files(files_to_delete, permanent_delete=False):
     """Process files based on user choice"""
-    successfully_processed = []
-    failed_processes = []
-
     action = "Deleting" if permanent_delete else "Moving"
     log.info(f"{action} files...")
-    for title, plex_files, sonarr_file, _ in tqdm(files_to_delete, desc=action, unit="item"):
+    disposals = []
+    for title, plex_files, sonarr_file, media_info in files_to_delete:
         for file in plex_files:
-            if file != sonarr_file:
-                try:
-                    abs_path = os.path.abspath(file)
-                    log.debug(f"Attempting to {action.lower()}: {abs_path}")
-                    if os.path.exists(abs_path):
-                        if permanent_delete:
-                            os.remove(abs_path)
-                            successfully_processed.append((abs_path, "Deleted"))
-                            log.info(f"Successfully deleted: {abs_path}")
-                        else:
-                            dest = os.path.join(TRASH_DIR, f"{title}_{os.path.basename(file)}")
-                            os.rename(abs_path, dest)
-                            successfully_processed.append((abs_path, dest))
-                            log.info(f"Successfully moved: {abs_path} to {dest}")
-                    else:
-                        log.warning(f"File not found: {abs_path}")
-                        failed_processes.append(abs_path)
-                except Exception as e:
-                    failed_processes.append(abs_path)
-                    log.error(f"Failed to {action.lower()} {abs_path}: {str(e)}")
+            if not same_file(file, sonarr_file):
+                # A copy that could not be checked may be a hardlink of the managed file
+                if (USE_POLICY or permanent_delete) and is_unverified(media_info, file):
+                    log.warning(f"Keeping {file}: it could not be verified against {sonarr_file}")
+                    continue
+                abs_path = os.path.abspath(file)
+                log.debug(f"Attempting to {action.lower()}: {abs_path}")
+                disposals.append((abs_path, f"{title}_{os.path.basename(file)}"))
 
-    return successfully_processed, failed_processes
+    return dispose_files(disposals, TRASH_DIR, permanent_delete, workers=DISPOSAL_WORKERS,
+                         per_mount_trash=PER_MOUNT_TRASH, restore_index=RESTORE_INDEX)
+
+def generate_dry_run_report(files_to_delete, instance_name):
+    """Stream a structured dry run report with one row per duplicate group"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"dry_run_report_{instance_name}_{timestamp}.{REPORT_FORMAT}"
+
+    with ReportWriter(filename, REPORT_FORMAT) as report:
+        report.write_groups(instance_name, files_to_delete, same_file)
+
+    log.info(f"Dry run report generated: {filename}")
+    return filename
 
 def main(dry_run):
     log.info("Starting Sonarr duplicate file management process")
@@ -209,6 +308,12 @@ def main(dry_run):
         sonarr_items = get_sonarr_items()
         
         files_to_delete = compare_and_mark_for_deletion(plex_duplicates, sonarr_items)
+
+        if args.analytics:
+            reclaimable = ReclaimableSpace()
+            reclaimable.add_groups("Sonarr", SONARR_PLEX_LIBRARY, files_to_delete, same_file)
+            reclaimable.log_summary()
+            return
         
         if not files_to_delete:
             log.info("No duplicate files to process")
@@ -217,14 +322,18 @@ def main(dry_run):
         confirmed_files = confirm_deletion(files_to_delete, dry_run)
         
         if dry_run:
-            log.info("DRY RUN: No files were actually processed. Check the log for details.")
+            report_file = generate_dry_run_report(confirmed_files, "Sonarr")
+            log.info(f"DRY RUN: No files were actually processed. Check {report_file} for details.")
         elif confirmed_files:
-            while True:
-                action_choice = input("\nDo you want to permanently delete the files or move them to trash? (delete/trash): ").strip().lower()
-                if action_choice in ['delete', 'trash']:
-                    break
-                else:
-                    print("Invalid choice. Please enter 'delete' or 'trash'.")
+            if USE_POLICY:
+                action_choice = POLICY.action
+            else:
+                while True:
+                    action_choice = input("\nDo you want to permanently delete the files or move them to trash? (delete/trash): ").strip().lower()
+                    if action_choice in ['delete', 'trash']:
+                        break
+                    else:
+                        print("Invalid choice. Please enter 'delete' or 'trash'.")
 
             permanent_delete = action_choice == 'delete'
             successfully_processed, failed_processes = process_files(confirmed_files, permanent_delete)
@@ -238,7 +347,7 @@ def main(dry_run):
                 log.info("Files that still exist in their original location:")
                 for _, plex_files, sonarr_file, _ in confirmed_files:
                     for file in plex_files:
-                        if file != sonarr_file and os.path.exists(file):
+                        if not same_file(file, sonarr_file) and os.path.exists(file):
                             log.info(str(file))
         else:
             log.info("No files confirmed for processing")
@@ -246,7 +355,12 @@ def main(dry_run):
     except Exception as e:
         log.error(f"An error occurred during the process: {str(e)}")
     
+    log.info(f"HTTP client: {client.stats.summary()}")
     log.info("Sonarr duplicate file management process completed")
 
 if __name__ == "__main__":
-    main(args.dry_run)
\ No newline at end of file
+    if args.restore:
+        restored, failed = restore_files(RESTORE_INDEX)
+        log.info(f"Restored {len(restored)} files, {len(failed)} failed")
+    else:
+        main(args.dry_run)
\ No newline at end of file
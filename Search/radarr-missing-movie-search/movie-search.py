@@ -1,11 +1,21 @@
-import requests
+import asyncio
 import time
 import logging
+import math
+import sqlite3
+from contextlib import closing
 from requests.exceptions import RequestException, HTTPError
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import os
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 
+# The shared HTTP client and metrics live in Common/ at the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'Common'))
+from arr_client import ArrClient
+from metrics import Metrics, serve_metrics
+
 # Load environment variables
 load_dotenv()
 
@@ -23,52 +33,175 @@ RADARR_INSTANCES = [
 ]
 
 # Script settings
-SEARCH_INTERVAL = 600  # 10 minutes in seconds
-BATCH_SIZE = 8
+SEARCH_INTERVAL = int(os.getenv("SEARCH_INTERVAL", 600))  # 10 minutes in seconds
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 8))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", 5))
 CLEAR_SEARCHED_IDS_INTERVAL = int(os.getenv("CLEAR_SEARCHED_IDS_INTERVAL", 86400))  # 24 hours in seconds
+RUN_ONCE = os.getenv("RUN_ONCE", "false").lower() == "true"  # Exit after one search cycle per instance
+
+# Searched-movie ledger settings
+LEDGER_FILE = os.getenv("LEDGER_FILE", "searched_movies.db")
+SEARCH_COOLDOWN = int(os.getenv("SEARCH_COOLDOWN", CLEAR_SEARCHED_IDS_INTERVAL))  # Wait after the first search of a movie
+MAX_SEARCH_COOLDOWN = int(os.getenv("MAX_SEARCH_COOLDOWN", 30 * 86400))  # Cap for the doubling cooldown
+
+# Missing list settings
+MISSING_PAGE_SIZE = 1000
+INCREMENTAL_MISSING = os.getenv("INCREMENTAL_MISSING", "true").lower() == "true"
+MISSING_FULL_REFRESH_INTERVAL = int(os.getenv("MISSING_FULL_REFRESH_INTERVAL", 21600))  # 6 hours in seconds
+missing_snapshots = {}  # Previous missing list for each instance, keyed by URL
+
+# Adaptive search settings
+ADAPTIVE_SEARCH = os.getenv("ADAPTIVE_SEARCH", "false").lower() == "true"
+MIN_BATCH_SIZE = int(os.getenv("MIN_BATCH_SIZE", 1))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 100))
+MIN_SEARCH_INTERVAL = int(os.getenv("MIN_SEARCH_INTERVAL", 60))
+MAX_SEARCH_INTERVAL = int(os.getenv("MAX_SEARCH_INTERVAL", 3600))
+TARGET_PENDING_SEARCHES = int(os.getenv("TARGET_PENDING_SEARCHES", 1))
+SEARCH_COMMANDS = {"moviessearch", "moviesearch", "missingmoviessearch"}
+
+# Shared HTTP client settings
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", 10))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", 0))  # Requests per second per instance, 0 to disable
+
+client = ArrClient(timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, rate_limit=RATE_LIMIT or None)
+
+# Metrics endpoint settings
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Port for the Prometheus /metrics endpoint, 0 to disable
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+metrics = Metrics("movie_search", rates=("searched_movies",))
+metrics.describe("span_seconds", "Time spent per instance in the fetch, diff, search and sleep phases")
+metrics.describe("api_errors_total", "Failed Radarr API operations per instance")
+metrics.describe("cycles_total", "Completed or failed search cycles per instance")
+metrics.describe("searched_movies_total", "Movies sent to Radarr in a search command")
+metrics.describe("searched_movies_per_hour", "Movies sent to Radarr in a search command over the last hour")
+metrics.describe("missing_movies", "Monitored movies without a file in the last fetched missing list")
+metrics.describe("backlog_movies", "Missing movies due for a search at the start of the cycle")
+metrics.describe("cooling_down_movies", "Missing movies waiting for their search cooldown to expire")
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-def get_missing_movies(instance: Dict) -> List[Dict]:
-    """Retrieves a list of missing movies from a Radarr instance using pagination."""
+def fetch_missing_page(instance: Dict, page: int, page_size: int, monitored: bool = True) -> Dict:
+    """Fetches one page of the monitored (or unmonitored) wanted/missing list from a Radarr instance."""
     url = f"{instance['url']}/api/v3/wanted/missing"
     headers = {"X-Api-Key": instance['api_key']}
     params = {
-        "pageSize": 1000,
+        "page": page,
+        "pageSize": page_size,
         "sortKey": "title",
         "sortDirection": "ascending",
-        "monitored": "true"
+        "monitored": "true" if monitored else "false"
     }
+    response = client.get(url, params=params, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_all_missing_movies(instance: Dict) -> Tuple[List[Dict], int]:
+    """Pages through the whole missing list and stores it as the new snapshot; returns the movies and request count."""
+    sync_start = time.time()
     all_missing_movies = []
+    page = 1
+    request_count = 0
 
-    try:
-        while True:
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+    while True:
+        data = fetch_missing_page(instance, page, MISSING_PAGE_SIZE)
+        request_count += 1
+        all_missing_movies.extend(data['records'])
+
+        if len(all_missing_movies) >= data['totalRecords'] or not data['records']:
+            break
+
+        page = data['page'] + 1
+
+    missing_snapshots[instance['url']] = {
+        "synced_at": sync_start,
+        "full_sync_at": sync_start,
+        "movies": {movie["id"]: movie for movie in all_missing_movies},
+        "unmonitored_total": fetch_missing_page(instance, 1, 1, monitored=False)['totalRecords']
+    }
+    return all_missing_movies, request_count + 1
+
+
+def refresh_missing_movies(instance: Dict, snapshot: Dict) -> Tuple[Optional[List[Dict]], int]:
+    """Updates the previous snapshot from cheap signals; returns None as the movies when a full fetch is needed."""
+    sync_start = time.time()
+    headers = {"X-Api-Key": instance['api_key']}
+
+    # A one-record page is enough to learn the current totalRecords
+    total_records = fetch_missing_page(instance, 1, 1)['totalRecords']
+    # Monitoring changes leave no history event, so an unmonitored movie could cancel out a newly
+    # added one in the total and stay in the snapshot; any change to the unmonitored count rules that out
+    unmonitored_total = fetch_missing_page(instance, 1, 1, monitored=False)['totalRecords']
+    if unmonitored_total != snapshot.get("unmonitored_total"):
+        return None, 2
+    since = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(snapshot["synced_at"]))
+    response = client.get(f"{instance['url']}/api/v3/history/since", params={"date": since}, headers=headers)
+    response.raise_for_status()
+    request_count = 3
+    changed_ids = {event["movieId"] for event in response.json() if event.get("movieId")}
+
+    movies = snapshot["movies"]
+    if not changed_ids and total_records == len(movies):
+        snapshot["synced_at"] = sync_start
+        return list(movies.values()), request_count
+
+    # Past the point where refetching the changed movies costs more than paging the whole list again
+    if len(changed_ids) >= math.ceil(total_records / MISSING_PAGE_SIZE):
+        return None, request_count
+
+    for movie_id in changed_ids:
+        response = client.get(f"{instance['url']}/api/v3/movie/{movie_id}", headers=headers)
+        request_count += 1
+        if response.status_code == 404:
+            movies.pop(movie_id, None)
+            continue
+        response.raise_for_status()
+        movie = response.json()
+        if movie.get("monitored") and not movie.get("hasFile"):
+            movies[movie_id] = movie
+        else:
+            movies.pop(movie_id, None)
+
+    # Movies that became missing without a history event (e.g. newly added) only show up in the total
+    if len(movies) != total_records:
+        return None, request_count
 
-            all_missing_movies.extend(data['records'])
+    snapshot["synced_at"] = sync_start
+    return list(movies.values()), request_count
 
-            if len(all_missing_movies) >= data['totalRecords']:
-                break
 
-            params['page'] = data['page'] + 1
+def get_missing_movies(instance: Dict) -> List[Dict]:
+    """Retrieves a list of missing movies from a Radarr instance, reusing the previous snapshot when possible."""
+    try:
+        snapshot = missing_snapshots.get(instance['url'])
+        request_count = 0
+        if INCREMENTAL_MISSING and snapshot and time.time() - snapshot["full_sync_at"] < MISSING_FULL_REFRESH_INTERVAL:
+            movies, request_count = refresh_missing_movies(instance, snapshot)
+            if movies is not None:
+                logger.info(f"Refreshed missing list for {instance['url']} incrementally: {len(movies)} movies, {request_count} API requests.")
+                return movies
 
-        return all_missing_movies
+        movies, full_request_count = fetch_all_missing_movies(instance)
+        request_count += full_request_count
+        logger.info(f"Fetched full missing list for {instance['url']}: {len(movies)} movies, {request_count} API requests.")
+        return movies
     except HTTPError as http_err:
+        metrics.inc("api_errors", instance=instance['url'], operation="fetch")
         logger.error(f"HTTP error occurred while fetching missing movies from {instance['url']}: {http_err}")
-        if response.status_code == 401:
+        if http_err.response.status_code == 401:
             logger.error("Unauthorized access. Please check your API key.")
-        elif response.status_code == 404:
+        elif http_err.response.status_code == 404:
             logger.error("The specified endpoint was not found. Please check your Radarr API URL.")
-        elif response.status_code >= 500:
+        elif http_err.response.status_code >= 500:
             logger.error("Server error. The Radarr server might be experiencing issues.")
         raise
     except RequestException as e:
+        metrics.inc("api_errors", instance=instance['url'], operation="fetch")
         logger.error(f"Error fetching missing movies from {instance['url']}: {e}")
         raise
 
@@ -79,10 +212,11 @@ def search_movies(instance: Dict, movie_ids: List[int]) -> bool:
     headers = {"X-Api-Key": instance['api_key']}
     data = {"name": "moviesSearch", "movieIds": movie_ids}
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=10)
+        response = client.post(url, headers=headers, json=data)
         response.raise_for_status()
         return True
     except HTTPError as http_err:
+        metrics.inc("api_errors", instance=instance['url'], operation="search")
         logger.error(f"HTTP error occurred while searching for movies in {instance['url']}: {http_err}")
         if response.status_code == 401:
             logger.error("Unauthorized access. Please check your API key.")
@@ -92,67 +226,192 @@ def search_movies(instance: Dict, movie_ids: List[int]) -> bool:
             logger.error("Server error. The Radarr server might be experiencing issues.")
         return False
     except RequestException as e:
+        metrics.inc("api_errors", instance=instance['url'], operation="search")
         logger.error(f"Error searching for movies in {instance['url']}: {e}")
         return False
 
 
-def main():
-    """Main function to execute the script."""
-    searched_ids = {}  # Keep track of searched movie IDs for each instance
-    retry_count = {}
-    last_clear_time = {}
+def open_ledger() -> sqlite3.Connection:
+    """Opens the searched-movie ledger, creating its table on first use."""
+    conn = sqlite3.connect(LEDGER_FILE, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS searches ("
+        "instance TEXT, movie_id INTEGER, last_searched REAL, attempts INTEGER, PRIMARY KEY (instance, movie_id))"
+    )
+    return conn
+
+
+def load_ledger(instance: Dict, missing_ids: set) -> Dict[int, Tuple[float, int]]:
+    """Loads the search history of an instance and forgets movies that are no longer missing."""
+    with closing(open_ledger()) as conn, conn:
+        rows = conn.execute(
+            "SELECT movie_id, last_searched, attempts FROM searches WHERE instance = ?", (instance['url'],)
+        ).fetchall()
+        conn.executemany(
+            "DELETE FROM searches WHERE instance = ? AND movie_id = ?",
+            [(instance['url'], movie_id) for movie_id, _, _ in rows if movie_id not in missing_ids]
+        )
+    return {movie_id: (last_searched, attempts) for movie_id, last_searched, attempts in rows if movie_id in missing_ids}
+
+
+def record_searches(instance: Dict, movie_ids: List[int]) -> None:
+    """Stores the search time and bumps the attempt count of each searched movie."""
+    now = time.time()
+    with closing(open_ledger()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO searches VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (instance, movie_id) DO UPDATE SET last_searched = excluded.last_searched, attempts = attempts + 1",
+            [(instance['url'], movie_id, now) for movie_id in movie_ids]
+        )
+
+
+def search_cooldown(attempts: int) -> float:
+    """Returns how long to wait before searching a movie again; doubles with every attempt."""
+    return min(SEARCH_COOLDOWN * 2 ** (attempts - 1), MAX_SEARCH_COOLDOWN)
+
+
+def search_priority(movie: Dict) -> Tuple[str, str]:
+    """Sort key that puts recently released, then recently added, movies first."""
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    release_dates = [movie.get(field) or "" for field in ("digitalRelease", "physicalRelease", "inCinemas")]
+    released = max((date for date in release_dates if date <= now), default="")
+    return released, movie.get("added") or ""
+
+
+def movies_due_for_search(instance: Dict, missing_movies: List[Dict]) -> List[int]:
+    """Returns the IDs of missing movies whose cooldown has expired, highest priority first."""
+    ledger = load_ledger(instance, {movie["id"] for movie in missing_movies})
+    now = time.time()
+    due_movies = [
+        movie for movie in missing_movies
+        if movie["id"] not in ledger or now - ledger[movie["id"]][0] >= search_cooldown(ledger[movie["id"]][1])
+    ]
+    due_movies.sort(key=search_priority, reverse=True)
+    return [movie["id"] for movie in due_movies]
+
+
+def get_search_load(instance: Dict) -> Dict:
+    """Returns the pending search commands and rate-limited indexers of a Radarr instance."""
+    headers = {"X-Api-Key": instance['api_key']}
+
+    response = client.get(f"{instance['url']}/api/v3/command", headers=headers)
+    response.raise_for_status()
+    pending = sum(
+        1 for command in response.json()
+        if command.get("name", "").lower() in SEARCH_COMMANDS and command.get("status") in ("queued", "started")
+    )
+
+    # Indexers that hit a rate limit or keep failing are disabled until a point in the future
+    response = client.get(f"{instance['url']}/api/v3/indexerstatus", headers=headers)
+    response.raise_for_status()
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    disabled = sum(1 for status in response.json() if (status.get("disabledTill") or "") > now)
 
-    for instance in RADARR_INSTANCES:
-        searched_ids[instance['url']] = set()
-        retry_count[instance['url']] = 0
-        last_clear_time[instance['url']] = time.time()
+    return {"pending": pending, "disabled_indexers": disabled}
+
+
+def adapt_pacing(batch_size: int, interval: int, load: Dict) -> Tuple[int, int]:
+    """Grows the batch size and shortens the interval while Radarr keeps up, and backs off when it does not."""
+    if load["disabled_indexers"] or load["pending"] > TARGET_PENDING_SEARCHES:
+        return max(MIN_BATCH_SIZE, batch_size // 2), min(MAX_SEARCH_INTERVAL, interval * 2)
+    if load["pending"] == 0:
+        return min(MAX_BATCH_SIZE, batch_size * 2), max(MIN_SEARCH_INTERVAL, interval // 2)
+    return batch_size, interval
+
+
+async def run_instance(instance: Dict) -> None:
+    """Runs the search loop for one Radarr instance with its own timer, backoff and batch cursor."""
+    loop = asyncio.get_running_loop()
+    retry_count = 0
+    batch_size = BATCH_SIZE
+    interval = SEARCH_INTERVAL
 
     while True:
-        for instance in RADARR_INSTANCES:
-            try:
-                missing_movies = get_missing_movies(instance)
-                unsearched_ids = [
-                    movie["id"] for movie in missing_movies if movie["id"] not in searched_ids[instance['url']]
-                ]
-                logger.info(f"Found {len(unsearched_ids)} unsearched missing movies in {instance['url']}.")
-
-                if not unsearched_ids:
-                    logger.info(f"No new missing movies to search for in {instance['url']}. Waiting for next cycle...")
-                    time.sleep(SEARCH_INTERVAL)
-                    continue
-
-                for i in range(0, len(unsearched_ids), BATCH_SIZE):
-                    batch_ids = unsearched_ids[i: i + BATCH_SIZE]
-                    if search_movies(instance, batch_ids):
-                        searched_ids[instance['url']].update(batch_ids)
-                        logger.info(f"Searched for movies with IDs: {batch_ids} in {instance['url']}")
-                    else:
-                        logger.warning(f"Failed to search for batch: {batch_ids} in {instance['url']}")
-
-                    if i + BATCH_SIZE < len(unsearched_ids):
-                        logger.info(f"Waiting {SEARCH_INTERVAL} seconds before next batch in {instance['url']}...")
-                        time.sleep(SEARCH_INTERVAL)
-
-                # Clear searched_ids periodically
-                if time.time() - last_clear_time[instance['url']] > CLEAR_SEARCHED_IDS_INTERVAL:
-                    logger.info(f"Clearing searched IDs for {instance['url']}...")
-                    searched_ids[instance['url']].clear()
-                    last_clear_time[instance['url']] = time.time()
-
-                logger.info(f"Completed search cycle for {instance['url']}. Waiting {SEARCH_INTERVAL} seconds for next cycle...")
-                time.sleep(SEARCH_INTERVAL)
-                retry_count[instance['url']] = 0  # Reset retry count on success
-
-            except Exception as e:
-                logger.error(f"An unexpected error occurred in {instance['url']}: {e}")
-                retry_count[instance['url']] += 1
-                wait_time = min(SEARCH_INTERVAL * (2 ** retry_count[instance['url']]), 3600)  # Cap at 1 hour
-                if retry_count[instance['url']] >= MAX_RETRIES:
-                    logger.error(f"Max retries reached for {instance['url']}. Clearing searched IDs and resetting retry count.")
-                    searched_ids[instance['url']].clear()
-                    retry_count[instance['url']] = 0
-                logger.info(f"Retrying {instance['url']} in {wait_time} seconds...")
-                time.sleep(wait_time)
+        try:
+            # The HTTP calls and the SQLite ledger are blocking, so run them in the default executor to keep other instances moving
+            with metrics.span("fetch", instance=instance['url']):
+                missing_movies = await loop.run_in_executor(None, get_missing_movies, instance)
+            with metrics.span("diff", instance=instance['url']):
+                unsearched_ids = await loop.run_in_executor(None, movies_due_for_search, instance, missing_movies)
+            metrics.set("missing_movies", len(missing_movies), instance=instance['url'])
+            metrics.set("backlog_movies", len(unsearched_ids), instance=instance['url'])
+            metrics.set("cooling_down_movies", len(missing_movies) - len(unsearched_ids), instance=instance['url'])
+            logger.info(f"Found {len(unsearched_ids)} missing movies due for a search in {instance['url']} "
+                        f"({len(missing_movies) - len(unsearched_ids)} still cooling down).")
+
+            if not unsearched_ids:
+                metrics.inc("cycles", instance=instance['url'], result="success")
+                if RUN_ONCE:
+                    logger.info(f"No new missing movies to search for in {instance['url']}.")
+                    return
+                logger.info(f"No new missing movies to search for in {instance['url']}. Waiting for next cycle...")
+                with metrics.span("sleep", instance=instance['url']):
+                    await asyncio.sleep(SEARCH_INTERVAL)
+                continue
+
+            cursor = 0
+            while cursor < len(unsearched_ids):
+                if ADAPTIVE_SEARCH:
+                    try:
+                        load = await loop.run_in_executor(None, get_search_load, instance)
+                        batch_size, interval = adapt_pacing(batch_size, interval, load)
+                        logger.info(f"{instance['url']}: {load['pending']} pending searches, {load['disabled_indexers']} rate-limited indexers. "
+                                    f"Using batch size {batch_size} and interval {interval} seconds.")
+                    except RequestException as e:
+                        metrics.inc("api_errors", instance=instance['url'], operation="load")
+                        logger.warning(f"Could not check search load for {instance['url']}, keeping current pacing: {e}")
+
+                batch_ids = unsearched_ids[cursor: cursor + batch_size]
+                cursor += len(batch_ids)
+                with metrics.span("search", instance=instance['url']):
+                    searched = await loop.run_in_executor(None, search_movies, instance, batch_ids)
+                if searched:
+                    await loop.run_in_executor(None, record_searches, instance, batch_ids)
+                    metrics.inc("searched_movies", len(batch_ids), instance=instance['url'])
+                    metrics.set("backlog_movies", len(unsearched_ids) - cursor, instance=instance['url'])
+                    logger.info(f"Searched for movies with IDs: {batch_ids} in {instance['url']}")
+                else:
+                    logger.warning(f"Failed to search for batch: {batch_ids} in {instance['url']}")
+
+                if cursor < len(unsearched_ids):
+                    logger.info(f"Waiting {interval} seconds before next batch in {instance['url']}...")
+                    with metrics.span("sleep", instance=instance['url']):
+                        await asyncio.sleep(interval)
+
+            metrics.inc("cycles", instance=instance['url'], result="success")
+            if RUN_ONCE:
+                logger.info(f"Completed search cycle for {instance['url']}.")
+                return
+            logger.info(f"Completed search cycle for {instance['url']}. Waiting {SEARCH_INTERVAL} seconds for next cycle...")
+            with metrics.span("sleep", instance=instance['url']):
+                await asyncio.sleep(SEARCH_INTERVAL)
+            retry_count = 0  # Reset retry count on success
+
+        except Exception as e:
+            metrics.inc("cycles", instance=instance['url'], result="error")
+            logger.error(f"An unexpected error occurred in {instance['url']}: {e}")
+            if RUN_ONCE:
+                return
+            retry_count += 1
+            wait_time = min(SEARCH_INTERVAL * (2 ** retry_count), 3600)  # Cap at 1 hour
+            if retry_count >= MAX_RETRIES:
+                logger.error(f"Max retries reached for {instance['url']}. Resetting retry count.")
+                retry_count = 0
+            logger.info(f"Retrying {instance['url']} in {wait_time} seconds...")
+            with metrics.span("sleep", instance=instance['url']):
+                await asyncio.sleep(wait_time)
+
+
+async def run_all_instances() -> None:
+    """Runs every Radarr instance concurrently so a long backlog in one never delays the others."""
+    await asyncio.gather(*(run_instance(instance) for instance in RADARR_INSTANCES))
+
+
+def main():
+    """Main function to execute the script."""
+    if METRICS_PORT:
+        serve_metrics(metrics, METRICS_PORT, METRICS_HOST, client)
+    asyncio.run(run_all_instances())
 
 
 if __name__ == "__main__":
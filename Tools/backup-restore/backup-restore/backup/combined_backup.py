@@ -0,0 +1,151 @@
+"""Back up the Postgres databases and config.xml of every *arr application.
+
+Writes the same archives as combined_backup.sh, so the restore scripts work
+unchanged, but the applications are backed up concurrently by a bounded pool
+of workers, and each pg_dump is streamed straight into its deflated zip
+member. No .sql file ever touches the disk, and the timings and sizes of
+every database are reported at the end.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+# Databases of each application, with the file name prefix their dump has in the archive
+DATABASES = {
+    'sonarr': [('sonarr-main', 'sonarr_main_db'), ('sonarr-log', 'sonarr_log_db')],
+    'radarr': [('radarr-main', 'radarr_main_db'), ('radarr-log', 'radarr_log_db')],
+    'lidarr': [('lidarr-main', 'lidarr_main_db'), ('lidarr-log', 'lidarr_log_db')],
+    'readarr': [('readarr-main', 'readarr_main_db'), ('readarr-log', 'readarr_log_db'), ('readarr-cache', 'readarr_cache_db')],
+    'prowlarr': [('prowlarr-main', 'prowlarr_main_db')],
+    'bazarr': [('bazarr', 'bazarr_db')],
+}
+DUMP_CHUNK_SIZE = 1024 * 1024
+
+log = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Back up the Postgres databases and config.xml of every *arr application")
+    parser.add_argument("--apps", default=",".join(DATABASES), help=f"Comma separated applications to back up (default: {','.join(DATABASES)})")
+    parser.add_argument("--backup-dir", default="/home/user/backups", help="Base directory for the backups, one folder per application (default: /home/user/backups)")
+    parser.add_argument("--docker-dir", default="/home/user/docker", help="Base directory of the Docker containers (default: /home/user/docker)")
+    parser.add_argument("--db-user", default="qstick", help="PostgreSQL user (default: qstick)")
+    parser.add_argument("--workers", type=int, default=3, help="Applications backed up at the same time (default: 3)")
+    parser.add_argument("--compression-level", type=int, default=6, choices=range(10), metavar="0-9",
+                        help="Deflate level, lower is faster and larger (default: 6)")
+    return parser.parse_args()
+
+
+def format_bytes(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def dump_database(archive, container, db_user, database, member):
+    """Stream pg_dump of one database into a new member of an open zip archive"""
+    start = time.monotonic()
+    size = 0
+    # stderr goes to a temporary file so a chatty pg_dump can never block on a full pipe
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(['docker', 'exec', container, 'pg_dump', '-U', db_user, database],
+                                   stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            with archive.open(member, 'w', force_zip64=True) as output:
+                for chunk in iter(lambda: process.stdout.read(DUMP_CHUNK_SIZE), b''):
+                    output.write(chunk)
+                    size += len(chunk)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors='replace').strip()
+            raise RuntimeError(f"pg_dump of {database} failed with exit code {returncode}: {message}")
+
+    return {
+        'database': database,
+        'seconds': time.monotonic() - start,
+        'bytes': size,
+        'compressed_bytes': archive.getinfo(member).compress_size,
+    }
+
+
+def backup_app(app, args, timestamp):
+    """Write one application's archive; returns the stats of each database dump"""
+    backup_dir = Path(args.backup_dir) / app
+    backup_file = backup_dir / f"{app}_backup_{timestamp}.zip"
+    # The archive only gets its final name once it is complete
+    partial_file = backup_file.with_name(backup_file.name + '.partial')
+    container = f"{app}-postgres"
+    config_file = Path(args.docker_dir) / app / 'config' / 'config.xml'
+
+    log.info(f"Starting backup for {app}...")
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    stats = []
+    try:
+        with zipfile.ZipFile(partial_file, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=args.compression_level) as archive:
+            for database, prefix in DATABASES[app]:
+                result = dump_database(archive, container, args.db_user, database, f"{prefix}_{timestamp}.sql")
+                result['app'] = app
+                stats.append(result)
+                log.info(f"{app}: dumped {database} in {result['seconds']:.1f}s, {format_bytes(result['bytes'])} "
+                         f"({format_bytes(result['compressed_bytes'])} compressed)")
+            archive.write(config_file, f"config_{timestamp}.xml")
+        os.replace(partial_file, backup_file)
+    except BaseException:
+        if partial_file.exists():
+            partial_file.unlink()
+        raise
+
+    log.info(f"{app} backup completed: {backup_file}")
+    return stats
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    apps = [app.strip() for app in args.apps.split(',')]
+    unknown = [app for app in apps if app not in DATABASES]
+    if unknown:
+        sys.exit(f"Unknown applications: {', '.join(unknown)}")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log.info(f"Starting combined backup process for {', '.join(apps)} with {args.workers} workers...")
+    start = time.monotonic()
+    stats = []
+    failed_apps = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {app: executor.submit(backup_app, app, args, timestamp) for app in apps}
+        for app, future in futures.items():
+            try:
+                stats.extend(future.result())
+            except Exception as e:
+                log.error(f"{app} backup failed: {e}")
+                failed_apps.append(app)
+
+    log.info(f"{'database':<16}{'seconds':>9}{'dumped':>13}{'compressed':>13}")
+    for result in stats:
+        log.info(f"{result['database']:<16}{result['seconds']:>9.1f}{format_bytes(result['bytes']):>13}"
+                 f"{format_bytes(result['compressed_bytes']):>13}")
+    log.info(f"Dumped {format_bytes(sum(result['bytes'] for result in stats))} from {len(stats)} databases into "
+             f"{format_bytes(sum(result['compressed_bytes'] for result in stats))} in {time.monotonic() - start:.1f}s")
+
+    if failed_apps:
+        log.error(f"Backup process completed with errors. Failed apps: {' '.join(failed_apps)}")
+        sys.exit(1)
+    log.info("All backups completed successfully!")
+
+
+if __name__ == "__main__":
+    main()
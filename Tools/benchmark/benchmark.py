@@ -0,0 +1,186 @@
+"""Benchmark Phasarr and the Radarr Missing Movie Search against local fake servers.
+
+Every run starts fresh fake Plex, Radarr and Sonarr servers holding a generated
+library of the requested size, runs the tool as a subprocess in a temporary
+directory and reports its wall time, the requests it made and its peak memory.
+With --warm each tool is run a second time in the same directory, so the
+cached and incremental code paths are measured too.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from fake_servers import FakeServer, Library
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+TARGETS = {
+    'combined': REPO_ROOT / 'Phasarr' / 'combined' / 'combined-dupe-finder.py',
+    'sonarr': REPO_ROOT / 'Phasarr' / 'sonarr' / 'sonarr-dupe-cleaner.py',
+    'movie-search': REPO_ROOT / 'Search' / 'radarr-missing-movie-search' / 'movie-search.py',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the Starr-Apps-Tools scripts against local fake servers")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated library sizes (default: 1000,10000)")
+    parser.add_argument("--latency", type=float, default=5, help="Latency added to every response, in milliseconds (default: 5)")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"Comma separated tools to run (default: {','.join(TARGETS)})")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2, help="Share of items Plex reports as duplicates (default: 0.2)")
+    parser.add_argument("--missing-ratio", type=float, default=0.1, help="Share of movies without a file (default: 0.1)")
+    parser.add_argument("--warm", action="store_true", help="Run each tool a second time with its caches in place")
+    parser.add_argument("--timeout", type=int, default=1800, help="Seconds before a run is aborted (default: 1800)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show the requests per route for every run")
+    return parser.parse_args()
+
+
+def write_phasarr_config(workdir, servers, target):
+    """Write the config.ini for a Phasarr script and return its path"""
+    if target == 'combined':
+        instances = f"""
+[Radarr:Bench]
+URL = {servers['radarr'].url}
+APIKey = benchmark
+PlexLibrary = Movies
+
+[Sonarr:Bench]
+URL = {servers['sonarr'].url}
+APIKey = benchmark
+PlexLibrary = TV Shows
+"""
+    else:
+        instances = f"""
+[Sonarr]
+URL = {servers['sonarr'].url}
+APIKey = benchmark
+PlexLibrary = TV Shows
+"""
+    config = f"""[Plex]
+URL = {servers['plex'].url}
+Token = benchmark
+{instances}
+[General]
+TrashDirectory = {workdir / 'trash'}
+
+[Cache]
+Path = {workdir / 'phasarr_cache.db'}
+
+[Logging]
+LogFile = {workdir / 'phasarr.log'}
+"""
+    path = workdir / 'config.ini'
+    path.write_text(config)
+    return path
+
+
+def command_for(target, workdir, servers):
+    """Command line and environment for one benchmark run"""
+    env = dict(os.environ)
+    if target == 'movie-search':
+        env.update({
+            'RADARR_URL_1': servers['radarr'].url,
+            'RADARR_API_KEY_1': 'benchmark',
+            'RADARR_URL_2': servers['radarr2'].url,
+            'RADARR_API_KEY_2': 'benchmark',
+            'RUN_ONCE': 'true',
+            'SEARCH_INTERVAL': '0',
+            'BATCH_SIZE': '100',
+            'ADAPTIVE_SEARCH': 'false',
+            'LEDGER_FILE': str(workdir / 'searched_movies.db'),
+        })
+        return [sys.executable, str(TARGETS[target])], env
+    config = write_phasarr_config(workdir, servers, target)
+    return [sys.executable, str(TARGETS[target]), '--dry-run', '--config', str(config)], env
+
+
+def run_once(target, workdir, servers, timeout):
+    """Run a tool to completion and measure it"""
+    for server in servers.values():
+        server.reset()
+    command, env = command_for(target, workdir, servers)
+
+    start = time.monotonic()
+    with open(workdir / f"{target}.log", 'a') as output:
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=output, stderr=subprocess.STDOUT)
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        try:
+            # wait4 reaps the child and returns the resource usage of this run alone
+            _, status, usage = os.wait4(process.pid, 0)
+        finally:
+            timer.cancel()
+    wall_time = time.monotonic() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    routes = {
+        f"{name} {route}": count
+        for name, server in servers.items() for route, count in sorted(server.requests.items())
+    }
+    commands = {name: count for server in servers.values() for name, count in server.commands.items()}
+    return {
+        'wall_time': round(wall_time, 3),
+        'requests': sum(routes.values()),
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mib': round(usage.ru_maxrss / 1024, 1),
+        'exit_code': process.returncode,
+        'routes': routes,
+        'commands': commands,
+    }
+
+
+def start_servers(library, latency):
+    """Start the fake Plex, Radarr and Sonarr servers, plus a second Radarr for movie-search"""
+    return {
+        name: FakeServer(app, library, latency).start()
+        for name, app in [('plex', 'plex'), ('radarr', 'radarr'), ('radarr2', 'radarr'), ('sonarr', 'sonarr')]
+    }
+
+
+def main():
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    targets = [target.strip() for target in args.targets.split(',')]
+    unknown = [target for target in targets if target not in TARGETS]
+    if unknown:
+        sys.exit(f"Unknown targets: {', '.join(unknown)}")
+
+    results = []
+    print(f"{'target':<14}{'size':>8}  {'run':<5}{'wall s':>9}{'requests':>10}{'peak MiB':>10}{'exit':>6}")
+    for size in sizes:
+        library = Library(size, args.duplicate_ratio, args.missing_ratio)
+        library.warm()
+        servers = start_servers(library, args.latency / 1000)
+        try:
+            for target in targets:
+                with tempfile.TemporaryDirectory(prefix=f"bench-{target}-") as tmp:
+                    workdir = Path(tmp)
+                    for run in ['cold', 'warm'] if args.warm else ['cold']:
+                        result = {'target': target, 'size': size, 'run': run, 'latency_ms': args.latency,
+                                  **run_once(target, workdir, servers, args.timeout)}
+                        results.append(result)
+                        print(f"{target:<14}{size:>8}  {run:<5}{result['wall_time']:>9.2f}{result['requests']:>10}"
+                              f"{result['peak_rss_mib']:>10.1f}{result['exit_code']:>6}")
+                        if args.verbose:
+                            for route, count in result['routes'].items():
+                                print(f"    {count:>8}  {route}")
+                        if result['exit_code'] != 0:
+                            print(f"    {target} failed, output follows:")
+                            print((workdir / f"{target}.log").read_text()[-4000:])
+        finally:
+            for server in servers.values():
+                server.stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""Local stand-ins for the Plex, Radarr and Sonarr APIs used by the benchmarks.
+
+The servers generate a deterministic library of a given size, add a fixed
+latency to every response and count the requests they receive per route, so
+the benchmark can report how many calls each tool makes.
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import quoteattr
+
+MOVIE_ROOT = '/media/movies'
+TV_ROOT = '/media/tv'
+EPISODES_PER_SERIES = 20
+UPDATED_AT = 1700000000
+SECTION_TYPES = {'1': ('movie',), '2': ('show', 'episode')}
+
+
+class Library:
+    """Deterministic movie and episode library shared by all fake servers"""
+
+    def __init__(self, size, duplicate_ratio=0.2, missing_ratio=0.1):
+        self.size = size
+        self.duplicate_every = max(1, round(1 / duplicate_ratio)) if duplicate_ratio else 0
+        self.missing_every = max(1, round(1 / missing_ratio)) if missing_ratio else 0
+        # Reentrant because the Plex item index is built from other cached responses
+        self.lock = threading.RLock()
+        self.cache = {}
+
+    def cached(self, key, build):
+        """Build a response body once and reuse it"""
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = build()
+            return self.cache[key]
+
+    # Radarr
+
+    def movie(self, movie_id):
+        year = 1950 + movie_id % 70
+        title = f"Movie {movie_id}"
+        has_file = not (self.missing_every and movie_id % self.missing_every == 0)
+        movie = {
+            'id': movie_id,
+            'title': title,
+            'year': year,
+            'tmdbId': 100000 + movie_id,
+            'imdbId': f"tt{1000000 + movie_id}",
+            'monitored': True,
+            'hasFile': has_file,
+            'added': '2023-01-01T00:00:00Z',
+            'inCinemas': f"{year}-06-01T00:00:00Z",
+            'lastInfoSync': '2023-06-01T00:00:00Z',
+        }
+        if has_file:
+            movie['movieFile'] = {
+                'path': f"{MOVIE_ROOT}/{title} ({year})/{title}.mkv",
+                'size': 4 * 1024 ** 3,
+                'dateAdded': '2023-01-02T00:00:00Z',
+            }
+        return movie
+
+    def movies(self):
+        return [self.movie(movie_id) for movie_id in range(1, self.size + 1)]
+
+    def missing_movies(self):
+        return [movie for movie in self.movies() if not movie['hasFile']]
+
+    # Sonarr
+
+    @property
+    def series_count(self):
+        return -(-self.size // EPISODES_PER_SERIES)
+
+    def episodes(self, series_id):
+        first = (series_id - 1) * EPISODES_PER_SERIES + 1
+        episodes = []
+        for number in range(first, min(first + EPISODES_PER_SERIES, self.size + 1)):
+            season, episode = divmod(number - first, 10)
+            episodes.append({
+                'id': number,
+                'seriesId': series_id,
+                'seasonNumber': season + 1,
+                'episodeNumber': episode + 1,
+                'tvdbId': 500000 + number,
+                'title': f"Episode {number}",
+                'hasFile': True,
+                'episodeFile': {'path': f"{TV_ROOT}/Show {series_id}/Season {season + 1}/Show {series_id} - S{season + 1:02d}E{episode + 1:02d}.mkv"},
+            })
+        return episodes
+
+    def series(self, series_id):
+        # Like Sonarr, only the statistics are included; episodes come from /api/v3/episode
+        episodes = self.episodes(series_id)
+        return {
+            'id': series_id,
+            'title': f"Show {series_id}",
+            'added': '2023-01-01T00:00:00Z',
+            'lastInfoSync': '2023-06-01T00:00:00Z',
+            'statistics': {'episodeFileCount': len(episodes)},
+        }
+
+    def all_series(self):
+        return [self.series(series_id) for series_id in range(1, self.series_count + 1)]
+
+    # Plex
+
+    def is_duplicate(self, item_id):
+        return bool(self.duplicate_every) and item_id % self.duplicate_every == 0
+
+    def plex_movie(self, movie):
+        path = movie['movieFile']['path']
+        copy = path.replace('.mkv', ' - 720p.mkv')
+        return (
+            f'<Video ratingKey="{movie["id"]}" key="/library/metadata/{movie["id"]}" type="movie" '
+            f'title={quoteattr(movie["title"])} year="{movie["year"]}" updatedAt="{UPDATED_AT}" addedAt="{UPDATED_AT}">'
+            f'<Media id="{movie["id"] * 2}" videoResolution="1080" videoCodec="h264" audioCodec="eac3">'
+            f'<Part id="{movie["id"] * 2}" key="/library/parts/{movie["id"] * 2}/file.mkv" file={quoteattr(path)} size="{4 * 1024 ** 3}"/></Media>'
+            f'<Media id="{movie["id"] * 2 + 1}" videoResolution="720" videoCodec="h264" audioCodec="aac">'
+            f'<Part id="{movie["id"] * 2 + 1}" key="/library/parts/{movie["id"] * 2 + 1}/file.mkv" file={quoteattr(copy)} size="{2 * 1024 ** 3}"/></Media>'
+            f'<Guid id="tmdb://{movie["tmdbId"]}"/><Guid id="imdb://{movie["imdbId"]}"/>'
+            f'</Video>'
+        )
+
+    def plex_episode(self, episode):
+        path = episode['episodeFile']['path']
+        copy = path.replace('.mkv', ' - 720p.mkv')
+        rating_key = 10 ** 7 + episode['id']
+        return (
+            f'<Video ratingKey="{rating_key}" key="/library/metadata/{rating_key}" type="episode" '
+            f'title={quoteattr(episode["title"])} grandparentTitle="Show {episode["seriesId"]}" '
+            f'parentIndex="{episode["seasonNumber"]}" index="{episode["episodeNumber"]}" '
+            f'updatedAt="{UPDATED_AT}" addedAt="{UPDATED_AT}">'
+            f'<Media id="{rating_key * 2}" videoResolution="1080" videoCodec="hevc" audioCodec="eac3">'
+            f'<Part id="{rating_key * 2}" key="/library/parts/{rating_key * 2}/file.mkv" file={quoteattr(path)} size="{1024 ** 3}"/></Media>'
+            f'<Media id="{rating_key * 2 + 1}" videoResolution="720" videoCodec="h264" audioCodec="aac">'
+            f'<Part id="{rating_key * 2 + 1}" key="/library/parts/{rating_key * 2 + 1}/file.mkv" file={quoteattr(copy)} size="{512 * 1024 ** 2}"/></Media>'
+            f'<Guid id="tvdb://{episode["tvdbId"]}"/>'
+            f'</Video>'
+        )
+
+    def plex_items(self, section):
+        """XML elements of every duplicate item in a Plex section"""
+        def build():
+            if section == '1':
+                return [self.plex_movie(movie) for movie in self.movies() if movie['hasFile'] and self.is_duplicate(movie['id'])]
+            return [
+                self.plex_episode(episode)
+                for series_id in range(1, self.series_count + 1)
+                for episode in self.episodes(series_id) if self.is_duplicate(episode['id'])
+            ]
+        return self.cached(('plex', section), build)
+
+    def plex_shows(self):
+        """Show elements Plex lists for a TV section searched without type=4"""
+        def build():
+            return [
+                f'<Directory ratingKey="{2 * 10 ** 7 + series_id}" key="/library/metadata/{2 * 10 ** 7 + series_id}/children" '
+                f'type="show" title="Show {series_id}" updatedAt="{UPDATED_AT}" addedAt="{UPDATED_AT}"/>'
+                for series_id in range(1, self.series_count + 1)
+                if any(self.is_duplicate(episode['id']) for episode in self.episodes(series_id))
+            ]
+        return self.cached('plex_shows', build)
+
+    def plex_item(self, rating_key):
+        """XML element of one duplicate item, for plexapi reloads"""
+        def build():
+            return {
+                re.match(r'<Video ratingKey="(\d+)"', item).group(1): item
+                for section in ('1', '2') for item in self.plex_items(section)
+            }
+        return self.cached('plex_index', build).get(rating_key)
+
+    def warm(self):
+        """Build every cached response up front so it is not timed"""
+        self.cached('movies', lambda: json.dumps(self.movies()).encode())
+        self.cached('series', lambda: json.dumps(self.all_series()).encode())
+        self.cached('missing', self.missing_movies)
+        self.plex_item('0')
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Route requests for one fake server, counting them and adding latency"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length', 0))
+            query['body'] = json.loads(self.rfile.read(length) or b'null')
+        self.server.count(method, url.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        handler = getattr(self, f"{self.server.app}_{method.lower()}")
+        status, content_type, body = handler(url.path, query)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def json(self, data, status=200):
+        return status, 'application/json', json.dumps(data).encode()
+
+    def xml(self, body):
+        return 200, 'application/xml', body.encode()
+
+    # Radarr and Sonarr
+
+    def common_get(self, path, query):
+        if path == '/api/v3/history/since':
+            return self.json([])
+        if path == '/api/v3/command':
+            return self.json([])
+        if path == '/api/v3/indexerstatus':
+            return self.json([])
+        return None
+
+    def arr_post(self, path, query):
+        if path == '/api/v3/command':
+            self.server.count_command(query['body'])
+            return self.json({'id': 1, 'name': query['body'].get('name'), 'status': 'queued'}, 201)
+        return self.json({'message': 'Not found'}, 404)
+
+    radarr_post = sonarr_post = arr_post
+
+    def radarr_get(self, path, query):
+        library = self.server.library
+        response = self.common_get(path, query)
+        if response:
+            return response
+        if path == '/api/v3/movie':
+            return 200, 'application/json', library.cached('movies', lambda: json.dumps(library.movies()).encode())
+        match = re.fullmatch(r'/api/v3/movie/(\d+)', path)
+        if match and 0 < int(match.group(1)) <= library.size:
+            return self.json(library.movie(int(match.group(1))))
+        if path == '/api/v3/wanted/missing':
+            missing = library.cached('missing', library.missing_movies)
+            page = int(query.get('page', 1))
+            page_size = int(query.get('pageSize', 10))
+            records = missing[(page - 1) * page_size:page * page_size]
+            return self.json({'page': page, 'pageSize': page_size, 'totalRecords': len(missing), 'records': records})
+        return self.json({'message': 'Not found'}, 404)
+
+    def sonarr_get(self, path, query):
+        library = self.server.library
+        response = self.common_get(path, query)
+        if response:
+            return response
+        if path == '/api/v3/series':
+            return 200, 'application/json', library.cached('series', lambda: json.dumps(library.all_series()).encode())
+        match = re.fullmatch(r'/api/v3/series/(\d+)', path)
+        if match and 0 < int(match.group(1)) <= library.series_count:
+            return self.json(library.series(int(match.group(1))))
+        if path == '/api/v3/episode' and 0 < int(query.get('seriesId', 0)) <= library.series_count:
+            return self.json(library.episodes(int(query['seriesId'])))
+        return self.json({'message': 'Not found'}, 404)
+
+    # Plex
+
+    def plex_get(self, path, query):
+        library = self.server.library
+        if path in ('/', '/identity'):
+            return self.xml('<MediaContainer size="0" machineIdentifier="benchmark" version="1.40.0.0" '
+                            'friendlyName="benchmark" myPlex="0" platform="Linux"/>')
+        if path == '/library':
+            return self.xml('<MediaContainer size="0" title1="Plex Library"/>')
+        if path == '/library/sections':
+            return self.xml(
+                '<MediaContainer size="2">'
+                '<Directory key="1" type="movie" title="Movies" agent="tv.plex.agents.movie" scanner="Plex Movie" language="en-US" uuid="movies"/>'
+                '<Directory key="2" type="show" title="TV Shows" agent="tv.plex.agents.series" scanner="Plex TV Series" language="en-US" uuid="shows"/>'
+                '</MediaContainer>'
+            )
+        match = re.fullmatch(r'/library/sections/(\d+)/all', path)
+        if match and 'includeMeta' in query:
+            return self.xml(self.plex_filter_meta(match.group(1)))
+        if match:
+            # Like Plex, a TV section lists shows unless episodes (type=4) are asked for
+            if match.group(1) == '2' and query.get('type') != '4':
+                items = library.plex_shows()
+            else:
+                items = library.plex_items(match.group(1))
+            if 'updatedAt>>' in query and int(query['updatedAt>>']) >= UPDATED_AT:
+                items = []
+            # plexapi pages with query parameters, the lean fetch with headers
+            start = int(query.get('X-Plex-Container-Start', self.headers.get('X-Plex-Container-Start', 0)))
+            size = int(query.get('X-Plex-Container-Size', self.headers.get('X-Plex-Container-Size', len(items))))
+            window = items[start:start + size]
+            return self.xml(
+                f'<MediaContainer size="{len(window)}" totalSize="{len(items)}" offset="{start}" '
+                f'librarySectionID="{match.group(1)}">{"".join(window)}</MediaContainer>'
+            )
+        # Collections, filters and other section listings plexapi asks for are empty
+        if re.fullmatch(r'/library/sections/\d+/\w+', path):
+            return self.xml('<MediaContainer size="0" totalSize="0"/>')
+        match = re.fullmatch(r'/library/metadata/(\d+)', path)
+        if match and library.plex_item(match.group(1)):
+            return self.xml(f'<MediaContainer size="1">{library.plex_item(match.group(1))}</MediaContainer>')
+        return 404, 'text/plain', b'Not found'
+
+    @staticmethod
+    def plex_filter_meta(section):
+        """Filter metadata plexapi validates search filters against, limited to 'duplicate'"""
+        types = ''.join(
+            f'<Type key="/library/sections/{section}/all?type={libtype}" type="{libtype}" title="{libtype}">'
+            '<Field key="duplicate" title="Duplicate" type="boolean"/></Type>'
+            for libtype in SECTION_TYPES.get(section, ())
+        )
+        return (
+            f'<MediaContainer size="0" totalSize="0"><Meta>{types}'
+            '<FieldType type="boolean"><Operator key="=" title="is true"/><Operator key="!=" title="is false"/></FieldType>'
+            '</Meta></MediaContainer>'
+        )
+
+
+class FakeServer(ThreadingHTTPServer):
+    """Threaded HTTP server for one app that counts requests per route"""
+    daemon_threads = True
+
+    def __init__(self, app, library, latency=0.0):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.app = app
+        self.library = library
+        self.latency = latency
+        self.requests = Counter()
+        self.commands = Counter()
+        self.counter_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, method, path):
+        route = re.sub(r'/\d+', '/{id}', path)
+        with self.counter_lock:
+            self.requests[f"{method} {route}"] += 1
+
+    def count_command(self, body):
+        with self.counter_lock:
+            self.commands[body.get('name')] += 1
+
+    def reset(self):
+        with self.counter_lock:
+            self.requests.clear()
+            self.commands.clear()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()